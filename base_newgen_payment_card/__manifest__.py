@@ -4,7 +4,7 @@
 
 {
     'name': 'New-generation payment card - Base module',
-    'version': '16.0.1.0.0',
+    'version': '16.0.1.4.0',
     'category': 'Accounting',
     'license': 'AGPL-3',
     'summary': 'New-generation payment card',
@@ -15,8 +15,10 @@
     'data': [
         'data/partner.xml',
         'data/sequence.xml',
+        'data/ir_cron.xml',
         'views/newgen_payment_card_transaction.xml',
         'views/newgen_payment_card.xml',
+        'views/newgen_payment_card_processing_run.xml',
         'security/ir.model.access.csv',
         'security/newgen_payment_card_security.xml',
     ],
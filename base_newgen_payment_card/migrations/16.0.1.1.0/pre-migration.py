@@ -0,0 +1,34 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    # reconcile_id and invoice_payment_state are now stored: create and fill
+    # the columns in SQL, so that the ORM doesn't compute them record
+    # by record on databases with many transactions
+    if not version:
+        return
+    cr.execute("""
+        ALTER TABLE newgen_payment_card_transaction
+        ADD COLUMN IF NOT EXISTS reconcile_id INTEGER,
+        ADD COLUMN IF NOT EXISTS invoice_payment_state VARCHAR""")
+    cr.execute("""
+        UPDATE newgen_payment_card_transaction trans
+        SET reconcile_id = aml.full_reconcile_id
+        FROM account_move_line aml
+        WHERE aml.move_id = trans.bank_move_id
+        AND aml.account_id = trans.bank_counterpart_account_id
+        AND aml.full_reconcile_id IS NOT NULL""")
+    logger.info('reconcile_id set on %d payment card transactions', cr.rowcount)
+    cr.execute("""
+        UPDATE newgen_payment_card_transaction trans
+        SET invoice_payment_state = am.payment_state
+        FROM account_move am
+        WHERE am.id = trans.invoice_id""")
+    logger.info(
+        'invoice_payment_state set on %d payment card transactions', cr.rowcount)
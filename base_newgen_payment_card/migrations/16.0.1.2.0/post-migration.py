@@ -0,0 +1,14 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import SUPERUSER_ID, api
+
+
+def migrate(cr, version):
+    # Fill the vendor labels from the transactions processed before
+    # the creation of newgen.payment.card.partner.label
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['newgen.payment.card.partner.label']._rebuild()
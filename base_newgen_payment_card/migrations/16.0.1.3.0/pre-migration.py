@@ -0,0 +1,30 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    # The constraint unique(name, company_id) on newgen.payment.card was
+    # never created (typo in _sql_constraints): merge the duplicate cards
+    # into the oldest one, so that the constraint can be added
+    if not version:
+        return
+    cr.execute("""
+        SELECT min(id), array_agg(id) FROM newgen_payment_card
+        GROUP BY name, company_id HAVING count(*) > 1""")
+    for card_id, duplicate_ids in cr.fetchall():
+        duplicate_ids = tuple(set(duplicate_ids) - {card_id})
+        for table in [
+                'newgen_payment_card_transaction',
+                'newgen_payment_card_account_mapping']:
+            cr.execute(
+                "UPDATE %s SET card_id=%%s WHERE card_id IN %%s" % table,
+                (card_id, duplicate_ids))
+        cr.execute(
+            "DELETE FROM newgen_payment_card WHERE id IN %s", (duplicate_ids, ))
+        logger.info(
+            'Payment cards %s merged into payment card %d', duplicate_ids, card_id)
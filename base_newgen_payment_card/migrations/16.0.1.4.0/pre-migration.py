@@ -0,0 +1,38 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+
+from unidecode import unidecode
+
+from odoo.tools import split_every
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    # vendor_label is a new stored field: create and fill the column in SQL,
+    # so that the ORM doesn't compute it record by record on databases
+    # with many transactions. The label is computed once per vendor, like
+    # newgen.payment.card.partner.label._normalize_label()
+    if not version:
+        return
+    cr.execute("""
+        ALTER TABLE newgen_payment_card_transaction
+        ADD COLUMN IF NOT EXISTS vendor_label VARCHAR""")
+    cr.execute("""
+        SELECT DISTINCT vendor FROM newgen_payment_card_transaction
+        WHERE vendor IS NOT NULL AND vendor_label IS NULL""")
+    vendors = [row[0] for row in cr.fetchall()]
+    count = 0
+    for vendor_chunk in split_every(1000, vendors, list):
+        cr.execute("""
+            UPDATE newgen_payment_card_transaction trans
+            SET vendor_label = label.vendor_label
+            FROM unnest(%s, %s) AS label(vendor, vendor_label)
+            WHERE trans.vendor = label.vendor""", (
+            vendor_chunk,
+            [unidecode(vendor).strip().upper() or None for vendor in vendor_chunk]))
+        count += cr.rowcount
+    logger.info('vendor_label set on %d payment card transactions', count)
@@ -1,3 +1,6 @@
 from . import newgen_payment_card
 from . import newgen_payment_card_transaction
 from . import newgen_payment_card_account_mapping
+from . import newgen_payment_card_receipt
+from . import newgen_payment_card_processing_run
+from . import newgen_payment_card_partner_label
@@ -47,8 +47,8 @@ class NewgenPaymentCard(models.Model):
             res.append((card.id, dname))
         return res
 
-    _sql_constrains = [(
+    _sql_constraints = [(
         'token_uniq',
-        'unique(name)',
+        'unique(name, company_id)',
         'This card already exists in the database!'
         )]
@@ -0,0 +1,161 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+
+from odoo import api, fields, models
+from odoo.tools import split_every
+from unidecode import unidecode
+
+logger = logging.getLogger(__name__)
+
+# Number of transactions read at once when rebuilding the table
+REBUILD_CHUNK_SIZE = 10000
+# Number of labels inserted or updated with one query
+UPSERT_CHUNK_SIZE = 1000
+
+
+class NewgenPaymentCardPartnerLabel(models.Model):
+    """Partner of the latest done expense transaction of each vendor label,
+    used to match the partner of the imported transactions. It is updated
+    when transactions are processed or when their partner changes,
+    so that the imports don't have to read the whole history"""
+    _name = 'newgen.payment.card.partner.label'
+    _description = 'Payment card vendor label to partner'
+    _order = 'label'
+    _rec_name = 'label'
+
+    label = fields.Char(required=True, readonly=True, index=True)
+    partner_id = fields.Many2one(
+        'res.partner', string='Partner', required=True, readonly=True,
+        ondelete='cascade')
+    company_id = fields.Many2one(
+        'res.company', string='Company', required=True, readonly=True,
+        ondelete='cascade')
+    transaction_id = fields.Many2one(
+        'newgen.payment.card.transaction', string='Latest Transaction',
+        required=True, readonly=True, ondelete='cascade')
+
+    _sql_constraints = [(
+        'label_company_uniq',
+        'unique(label, company_id)',
+        'This label already exists in this company.')]
+
+    @api.model
+    def _normalize_label(self, vendor):
+        return unidecode(vendor).strip().upper()
+
+    @api.model
+    def _get_label_transaction_domain(self):
+        """Domain of the transactions which give the partner of their label"""
+        default_partner = self.env[
+            'newgen.payment.card.transaction']._default_partner(
+                raise_if_not_found=True)
+        return [
+            ('state', '=', 'done'),
+            ('transaction_type', '=', 'expense'),
+            ('vendor_label', '!=', False),
+            ('partner_id', '!=', False),
+            ('partner_id', '!=', default_partner.id),
+            ]
+
+    @api.model
+    def _get_transaction_labels(self, transactions):
+        """Returns a dict with key = (label, company ID) and
+        value = (partner ID, transaction ID) for the latest transaction
+        of each label"""
+        default_partner = transactions._default_partner(raise_if_not_found=True)
+        res = {}
+        for trans in transactions.sorted('id'):
+            if (
+                    trans.state == 'done' and
+                    trans.transaction_type == 'expense' and
+                    trans.vendor_label and
+                    trans.partner_id and
+                    trans.partner_id != default_partner):
+                key = (trans.vendor_label, trans.company_id.id)
+                res[key] = (trans.partner_id.id, trans.id)
+        return res
+
+    @api.model
+    def _upsert(self, labels):
+        """labels is a dict as returned by _get_transaction_labels()"""
+        now = fields.Datetime.now()
+        values = [
+            (label, company_id, partner_id, trans_id,
+             self.env.uid, now, self.env.uid, now)
+            for (label, company_id), (partner_id, trans_id) in labels.items()]
+        for values_chunk in split_every(UPSERT_CHUNK_SIZE, values, list):
+            self.env.cr.execute("""
+                INSERT INTO newgen_payment_card_partner_label
+                (label, company_id, partner_id, transaction_id,
+                 create_uid, create_date, write_uid, write_date)
+                VALUES %s
+                ON CONFLICT (label, company_id) DO UPDATE SET
+                partner_id=EXCLUDED.partner_id,
+                transaction_id=EXCLUDED.transaction_id,
+                write_uid=EXCLUDED.write_uid,
+                write_date=EXCLUDED.write_date
+                WHERE newgen_payment_card_partner_label.transaction_id
+                <= EXCLUDED.transaction_id""" % ', '.join(
+                    ['%s'] * len(values_chunk)), values_chunk)
+
+    @api.model
+    def _get_previous_labels(self, label_keys):
+        """Returns the labels (as _get_transaction_labels()) given by
+        the latest remaining transaction of each (label, company ID)"""
+        npcto = self.env['newgen.payment.card.transaction'].with_context(
+            active_test=False)
+        domain = self._get_label_transaction_domain()
+        res = {}
+        for label, company_id in label_keys:
+            trans = npcto.search(domain + [
+                ('vendor_label', '=', label),
+                ('company_id', '=', company_id),
+                ], order='id desc', limit=1)
+            if trans:
+                res[(label, company_id)] = (trans.partner_id.id, trans.id)
+        return res
+
+    @api.model
+    def _update_from_transactions(self, transactions):
+        """Insert or update the labels of the transactions. A label
+        is only updated by a more recent transaction than the one
+        it comes from, so that the result doesn't depend on the order in
+        which the transactions are processed"""
+        if not transactions:
+            return True
+        labels = self._get_transaction_labels(transactions)
+        self.flush_model()
+        # The vendor or the partner of the transactions may have changed:
+        # their previous labels are replaced
+        self.env.cr.execute(
+            "DELETE FROM newgen_payment_card_partner_label "
+            "WHERE transaction_id IN %s RETURNING label, company_id",
+            (tuple(transactions.ids),))
+        removed = set(self.env.cr.fetchall()) - set(labels)
+        self._upsert(labels)
+        # A label which doesn't come from these transactions any more
+        # comes from the previous transaction with the same label, if any
+        if removed:
+            self._upsert(self._get_previous_labels(removed))
+        self.invalidate_model()
+        return True
+
+    @api.model
+    def _rebuild(self):
+        """Fill the table from all the done expense transactions
+        (used when the module is updated)"""
+        npcto = self.env['newgen.payment.card.transaction'].with_context(
+            active_test=False)
+        trans_ids = npcto.search(
+            self._get_label_transaction_domain(), order='id').ids
+        for trans_ids_chunk in split_every(REBUILD_CHUNK_SIZE, trans_ids):
+            transactions = npcto.browse(trans_ids_chunk)
+            self._update_from_transactions(transactions)
+            transactions.invalidate_recordset()
+        logger.info(
+            'Payment card vendor labels built from %d transactions',
+            len(trans_ids))
+        return True
@@ -0,0 +1,78 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+PROCESSING_RUN_RETENTION_DAYS = 90
+
+
+class NewgenPaymentCardProcessingRun(models.Model):
+    """Profile of a call to process_line() on payment card transactions,
+    recorded when the system parameter
+    newgen_payment_card.processing_profiling is set"""
+    _name = 'newgen.payment.card.processing.run'
+    _description = 'Payment card transactions processing run'
+    _order = 'id desc'
+    _rec_name = 'date'
+
+    date = fields.Datetime(
+        required=True, readonly=True, default=fields.Datetime.now)
+    user_id = fields.Many2one(
+        'res.users', string='User', required=True, readonly=True,
+        default=lambda self: self.env.user)
+    transaction_count = fields.Integer(
+        string='Number of Transactions', readonly=True)
+    duration = fields.Float(string='Duration (s)', readonly=True)
+    query_count = fields.Integer(string='Number of Queries', readonly=True)
+    size = fields.Integer(string='Downloaded Bytes', readonly=True)
+    stage_ids = fields.One2many(
+        'newgen.payment.card.processing.run.stage', 'run_id', string='Stages',
+        readonly=True)
+
+    @api.model
+    def _create_from_profiler(self, profiler, transaction_count):
+        stage_vals_list = []
+        for sequence, (name, stage) in enumerate(profiler.stages.items()):
+            stage_vals_list.append((0, 0, {
+                'sequence': sequence,
+                'name': name,
+                'transaction_count': stage['count'],
+                'duration': stage['duration'],
+                'duration_per_transaction': (
+                    stage['count'] and stage['duration'] * 1000 / stage['count']),
+                'query_count': stage['query_count'],
+                'size': stage['size'],
+                }))
+        return self.create({
+            'transaction_count': transaction_count,
+            'duration': profiler.duration,
+            'query_count': sum(
+                stage['query_count'] for stage in profiler.stages.values()),
+            'size': sum(stage['size'] for stage in profiler.stages.values()),
+            'stage_ids': stage_vals_list,
+            })
+
+    @api.autovacuum
+    def _gc_processing_runs(self):
+        limit = fields.Datetime.now() - timedelta(days=PROCESSING_RUN_RETENTION_DAYS)
+        self.search([('date', '<', limit)]).unlink()
+
+
+class NewgenPaymentCardProcessingRunStage(models.Model):
+    _name = 'newgen.payment.card.processing.run.stage'
+    _description = 'Stage of a payment card transactions processing run'
+    _order = 'run_id, sequence'
+
+    run_id = fields.Many2one(
+        'newgen.payment.card.processing.run', string='Processing Run',
+        required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer()
+    name = fields.Char(string='Stage', required=True)
+    transaction_count = fields.Integer(string='Number of Transactions')
+    duration = fields.Float(string='Duration (s)')
+    duration_per_transaction = fields.Float(string='Duration per Transaction (ms)')
+    query_count = fields.Integer(string='Number of Queries')
+    size = fields.Integer(string='Downloaded Bytes')
@@ -0,0 +1,212 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import base64
+import hashlib
+import logging
+import os
+from datetime import timedelta
+from urllib.parse import urlparse
+
+import psycopg2
+
+from odoo import api, fields, models
+
+from ..tools import ReceiptDownload, ReceiptDownloader
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 30
+DEFAULT_RECEIPT_CACHE_MAX_AGE = 24  # hours
+RECEIPT_CACHE_RETENTION_DAYS = 180
+JPEG_EXTENSIONS = ('.JPG', '.JPEG', '.jpg', '.jpeg')
+
+
+class NewgenPaymentCardReceipt(models.Model):
+    """Cache of the receipts downloaded when processing transactions.
+    It stores the receipt ready to be attached to the invoice (i.e. already
+    rotated), so that processing a transaction again (after an error for
+    example) doesn't download and rotate the same receipt again."""
+    _name = 'newgen.payment.card.receipt'
+    _description = 'Payment card receipt cache'
+    _rec_name = 'url'
+
+    url = fields.Char(string='URL', required=True, index=True)
+    file_extension = fields.Char()
+    # checksum of the content downloaded from the URL (before rotation)
+    checksum = fields.Char(index=True)
+    etag = fields.Char(string='ETag')
+    last_modified = fields.Char()
+    date_checked = fields.Datetime(
+        string='Last Check', help="Last time the URL was downloaded or revalidated")
+    image = fields.Binary(attachment=True)
+    size = fields.Integer(help="Size of the downloaded receipt in bytes")
+    normalized_size = fields.Integer(
+        help="Size of the receipt attached to the invoice in bytes")
+
+    _sql_constraints = [(
+        'url_uniq',
+        'unique(url)',
+        'A receipt URL can be cached only once!')]
+
+    @api.model
+    def _get_receipt_downloader(self):
+        ico = self.env['ir.config_parameter'].sudo()
+        return ReceiptDownloader(
+            max_workers=int(ico.get_param(
+                'newgen_payment_card.download_workers', 8)),
+            max_per_host=int(ico.get_param(
+                'newgen_payment_card.download_per_host', 4)),
+            retries=int(ico.get_param('newgen_payment_card.download_retries', 2)),
+            timeout=TIMEOUT)
+
+    @api.model
+    def _get_max_age(self):
+        max_age = self.env['ir.config_parameter'].sudo().get_param(
+            'newgen_payment_card.receipt_cache_max_age',
+            DEFAULT_RECEIPT_CACHE_MAX_AGE)
+        return timedelta(hours=float(max_age))
+
+    @api.model
+    def _url_file_extension(self, url):
+        return os.path.splitext(urlparse(url).path)[1]
+
+    @api.model
+    def _normalize_image(self, url, content):
+        """Returns the receipt as it will be attached to the invoice"""
+        if self._url_file_extension(url) in JPEG_EXTENSIONS:
+            logger.debug('Trying to rotate the JPG image %s', url)
+            npcto = self.env['newgen.payment.card.transaction']
+            try:
+                with npcto._profile('rotate_image'):
+                    normalized = npcto._rotate_image(content)
+                logger.info(
+                    'JPEG file successfully normalized: %d bytes saved',
+                    len(content) - len(normalized))
+                content = normalized
+            except Exception as e:
+                logger.info('Failed to rotate the image. Error: %s', e)
+        return content
+
+    def _cached_download(self):
+        self.ensure_one()
+        return ReceiptDownload(
+            self.url, 200, base64.b64decode(self.image), {}, None)
+
+    @api.model
+    def _fetch(self, urls):
+        """Returns a dict with key = URL and value = ReceiptDownload
+        whose content is the normalized receipt. Uses the cache when it
+        is recent enough, revalidates it with a conditional request
+        (ETag/Last-Modified) when it is older, and downloads the other URLs.
+        """
+        urls = list(dict.fromkeys(urls))
+        res = {}
+        cached = {}
+        for receipt in self.search([('url', 'in', urls), ('size', '>', 0)]):
+            cached[receipt.url] = receipt
+        limit = fields.Datetime.now() - self._get_max_age()
+        headers = {}
+        for url in urls:
+            receipt = cached.get(url)
+            if not receipt:
+                continue
+            if receipt.date_checked and receipt.date_checked >= limit:
+                logger.debug('Receipt %s taken from cache', url)
+                res[url] = receipt._cached_download()
+                continue
+            headers[url] = {}
+            if receipt.etag:
+                headers[url]['If-None-Match'] = receipt.etag
+            if receipt.last_modified:
+                headers[url]['If-Modified-Since'] = receipt.last_modified
+        to_download = [url for url in urls if url not in res]
+        if not to_download:
+            return res
+        logger.info('Downloading %d receipts', len(to_download))
+        with self._get_receipt_downloader() as downloader:
+            downloads = downloader.fetch_all(to_download, headers=headers)
+        profiler = (self.env.context.get('newgen_batch') or {}).get('profiler')
+        if profiler:
+            profiler.add_size('receipt_download', sum(
+                len(download.content or b'') for download in downloads.values()))
+        now = fields.Datetime.now()
+        for url, download in downloads.items():
+            receipt = cached.get(url)
+            if download.status_code == 304 and receipt:
+                logger.debug('Receipt %s not modified', url)
+                receipt.write({'date_checked': now})
+                res[url] = receipt._cached_download()
+            elif download.status_code == 200:
+                res[url] = self._store(url, download, receipt, now)
+            else:
+                res[url] = download
+        return res
+
+    @api.model
+    def _store(self, url, download, receipt, now):
+        checksum = hashlib.sha1(download.content).hexdigest()
+        file_extension = self._url_file_extension(url)
+        same_content = False
+        if receipt and receipt.checksum == checksum:
+            same_content = receipt
+        else:
+            same_content = self.search([
+                ('checksum', '=', checksum),
+                ('file_extension', '=', file_extension),
+                ('size', '>', 0),
+                ], limit=1)
+        if same_content:
+            logger.debug('Receipt %s has the same content as %s', url, same_content.url)
+            image_b64 = same_content.image
+            normalized_size = same_content.normalized_size
+        else:
+            image = self._normalize_image(url, download.content)
+            image_b64 = base64.b64encode(image)
+            normalized_size = len(image)
+        vals = {
+            'url': url,
+            'file_extension': file_extension,
+            'checksum': checksum,
+            'etag': download.headers.get('ETag'),
+            'last_modified': download.headers.get('Last-Modified'),
+            'date_checked': now,
+            'image': image_b64,
+            'size': len(download.content),
+            'normalized_size': normalized_size,
+            }
+        try:
+            with self.env.cr.savepoint():
+                if receipt:
+                    receipt.write(vals)
+                else:
+                    self.create(vals)
+        except psycopg2.IntegrityError:
+            # the same URL was cached by another worker in the meantime
+            logger.debug('Receipt %s already cached by another worker', url)
+        return download._replace(content=base64.b64decode(image_b64))
+
+    @api.model
+    def _get_image_attachments(self, urls):
+        """Returns a dict with key = URL and value = ir.attachment
+        holding the cached receipt"""
+        receipts = self.sudo().search([('url', 'in', urls), ('size', '>', 0)])
+        if not receipts:
+            return {}
+        url2id = {receipt.url: receipt.id for receipt in receipts}
+        attachments = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'image'),
+            ('res_id', 'in', receipts.ids),
+            ])
+        id2attachment = {att.res_id: att for att in attachments}
+        return {
+            url: id2attachment[receipt_id]
+            for url, receipt_id in url2id.items()
+            if receipt_id in id2attachment}
+
+    @api.autovacuum
+    def _gc_receipt_cache(self):
+        limit = fields.Datetime.now() - timedelta(days=RECEIPT_CACHE_RETENTION_DAYS)
+        self.search([('date_checked', '<', limit)]).unlink()
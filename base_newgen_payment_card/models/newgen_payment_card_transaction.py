@@ -4,26 +4,41 @@
 
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools import float_compare
+from odoo.tools import config, float_compare, split_every, str2bool
+from odoo.tools.lru import LRU
 from odoo.tools.misc import format_amount
-import requests
 import base64
 import logging
+from collections import defaultdict
+from contextlib import contextmanager
 from urllib.parse import urlparse
 import os
-import io
 import logging
 from unidecode import unidecode
+from psycopg2 import errors as pg_errors
+from ..tools import (
+    PartnerNameIndex, ProcessingProfiler, normalize_jpeg)
 
 MEANINGFUL_PARTNER_NAME_MIN_SIZE = 3
 TIMEOUT = 30
+# Number of speeddicts (one per database and company, each with its
+# partner name index) kept in the memory of the worker between 2 imports
+SPEEDDICT_CACHE_SIZE = 4
+# Max number of keys of the imported file searched with one query
+IMPORT_KEY_SEARCH_CHUNK = 500
+# 'direct': build the invoices from the transactions and create them in batch
+# 'import': create them one by one with account_invoice_import
+DEFAULT_INVOICE_ENGINE = 'direct'
+# Invoices created together (their receipts are in memory at the same time)
+INVOICE_CREATE_CHUNK_SIZE = 100
+DEFAULT_PROCESSING_BATCH_SIZE = 100
+# Fields of the transactions which give the vendor labels
+# of newgen.payment.card.partner.label
+PARTNER_LABEL_FIELDS = {'state', 'transaction_type', 'vendor', 'partner_id'}
 
 logger = logging.getLogger(__name__)
 
-try:
-    from PIL import Image, ImageOps
-except ImportError:
-    logger.debug('Cannot import Pillow version >= 6.0.0')
+speeddict_cache = LRU(SPEEDDICT_CACHE_SIZE)
 
 
 class NewgenPaymentCardTransaction(models.Model):
@@ -44,6 +59,9 @@ class NewgenPaymentCardTransaction(models.Model):
         string='Description', states={'done': [('readonly', True)]})
     unique_import_id = fields.Char(
         string='Unique Identifier', readonly=True, copy=False)
+    # hash of the line of the imported file, to skip the unchanged lines
+    # when the file is imported again
+    import_hash = fields.Char(readonly=True, copy=False)
     date = fields.Date(
         string='Bank Transaction Date', required=True, readonly=True,
         help="This is the date of the bank transaction written on the "
@@ -68,6 +86,9 @@ class NewgenPaymentCardTransaction(models.Model):
     analytic_distribution = fields.Json(states={'done': [('readonly', True)]})
     country_id = fields.Many2one('res.country', string='Country')
     vendor = fields.Char(string='Vendor', readonly=True)
+    # vendor normalized as in newgen.payment.card.partner.label
+    vendor_label = fields.Char(
+        compute='_compute_vendor_label', store=True, index=True)
     vendor_vat = fields.Char(string='Vendor VAT Number', readonly=True)
     partner_id = fields.Many2one(
         'res.partner', string='Vendor Partner',
@@ -125,10 +146,11 @@ class NewgenPaymentCardTransaction(models.Model):
         'account.move', string='Invoice', check_company=True,
         states={'done': [('readonly', True)]})
     invoice_payment_state = fields.Selection(
-        related='invoice_id.payment_state', string="Invoice Payment Status")
+        related='invoice_id.payment_state', string="Invoice Payment Status",
+        store=True, index=True)
     reconcile_id = fields.Many2one(
         'account.full.reconcile', string="Reconcile",
-        compute='_compute_reconcile_id', readonly=True)
+        compute='_compute_reconcile_id', store=True, index=True)
     bank_counterpart_account_id = fields.Many2one(
         'account.account',
         compute='_compute_bank_counterpart_account_id', store=True, precompute=True,
@@ -137,6 +159,9 @@ class NewgenPaymentCardTransaction(models.Model):
         string="Counter-part of Bank Move", check_company=True)
     bank_move_id = fields.Many2one(
         'account.move', string="Bank Move", readonly=True, check_company=True)
+    # Set by the scheduled processing, which skips the transactions
+    # in error until they are modified
+    processing_error = fields.Text(readonly=True, copy=False)
 
     _sql_constraints = [(
         'unique_import_id',
@@ -154,7 +179,10 @@ class NewgenPaymentCardTransaction(models.Model):
                     sequence_date=vals.get('date')) or _("New")
         return super().create(vals_list)
 
-    @api.depends('bank_move_id')
+    @api.depends(
+        'bank_move_id', 'bank_counterpart_account_id',
+        'bank_move_id.line_ids.account_id',
+        'bank_move_id.line_ids.full_reconcile_id')
     def _compute_reconcile_id(self):
         for trans in self:
             reconcile_id = False
@@ -169,26 +197,34 @@ class NewgenPaymentCardTransaction(models.Model):
 
     @api.depends("partner_id", "expense_account_id")
     def _compute_analytic_distribution(self):
+        # key = (partner, account code, company), value = distribution
+        distributions = {}
         for trans in self:
-            distribution = self.env[
-                "account.analytic.distribution.model"
-            ]._get_distribution(
-                {
-                    "partner_id": trans.partner_id.id,
-                    "partner_category_id": trans.partner_id.category_id.ids,
-                    "account_prefix": trans.expense_account_id.code,
-                    "company_id": trans.company_id.id,
-                }
-            )
-            trans.analytic_distribution = distribution or trans.analytic_distribution
+            key = (trans.partner_id, trans.expense_account_id.code, trans.company_id)
+            if key not in distributions:
+                distributions[key] = self.env[
+                    "account.analytic.distribution.model"
+                ]._get_distribution(
+                    {
+                        "partner_id": trans.partner_id.id,
+                        "partner_category_id": trans.partner_id.category_id.ids,
+                        "account_prefix": trans.expense_account_id.code,
+                        "company_id": trans.company_id.id,
+                    }
+                )
+            trans.analytic_distribution = (
+                distributions[key] or trans.analytic_distribution)
 
     @api.depends('invoice_id')
     def _compute_partner_id(self):
+        default_partner = None
         for trans in self:
             if trans.invoice_id:
                 partner = trans.invoice_id.commercial_partner_id
             else:
-                partner = trans._default_partner()
+                if default_partner is None:
+                    default_partner = self._default_partner()
+                partner = default_partner
             trans.partner_id = partner and partner.id or False
 
     def _default_partner(self, raise_if_not_found=False):
@@ -225,42 +261,370 @@ class NewgenPaymentCardTransaction(models.Model):
 
     @api.depends('partner_id', 'transaction_type', 'company_id')
     def _compute_bank_counterpart_account_id(self):
+        # key = (transaction type, company, partner), value = account ID
+        accounts = {}
         for trans in self:
-            account_id = False
-            if trans.transaction_type == 'load':
-                account_id = trans.company_id.transfer_account_id.id or False
-            elif trans.transaction_type == 'expense':
-                if trans.partner_id:
-                    account_id = trans.with_company(trans.company_id.id).partner_id.property_account_payable_id.id
-                else:
-                    account_id = self.env['ir.property'].with_company(
-                        trans.company_id.id)._get(
-                            'property_account_payable_id', 'res.partner')
-            trans.bank_counterpart_account_id = account_id
+            key = (trans.transaction_type, trans.company_id, trans.partner_id)
+            if key not in accounts:
+                accounts[key] = trans._get_bank_counterpart_account_id()
+            trans.bank_counterpart_account_id = accounts[key]
 
-    def process_line(self):
-        for line in self:
-            if line.state != 'draft':
-                logger.warning(
-                    'Skipping transaction %s which is not draft',
-                    line.name)
+    def _get_bank_counterpart_account_id(self):
+        self.ensure_one()
+        account_id = False
+        if self.transaction_type == 'load':
+            account_id = self.company_id.transfer_account_id.id or False
+        elif self.transaction_type == 'expense':
+            if self.partner_id:
+                account_id = self.with_company(self.company_id.id).partner_id.property_account_payable_id.id
+            else:
+                account_id = self.env['ir.property'].with_company(
+                    self.company_id.id)._get(
+                        'property_account_payable_id', 'res.partner')
+        return account_id
+
+    def _get_receipts_to_download(self):
+        """Returns the transactions whose receipt will be downloaded
+        by process_line()"""
+        return self.filtered(
+            lambda x: x.state == 'draft' and
+            x.transaction_type == 'expense' and
+            not x.bank_move_only and
+            not x.invoice_id and
+            x.image_url)
+
+    @api.model
+    def _fetch_receipts(self, urls):
+        """Returns a dict with key = URL and value = ReceiptDownload
+        whose content is the receipt ready to be attached to the invoice.
+        The receipt cache is updated in a separate transaction, so that
+        it is kept even if the processing of the transactions fails.
+        When running the tests, it is updated in the current transaction,
+        so that it is rolled back with the test."""
+        if not urls:
+            return {}
+        if self.pool.in_test_mode() or config['test_enable']:
+            return self.env['newgen.payment.card.receipt'].sudo()._fetch(urls)
+        with self.pool.cursor() as cr:
+            res = self.env(cr=cr, su=True)['newgen.payment.card.receipt']._fetch(
+                urls)
+            cr.commit()
+        return res
+
+    def _prefetch_receipts(self):
+        """Download the receipts of the transactions in parallel.
+        Returns a dict with key = URL and value = ReceiptDownload"""
+        return self._fetch_receipts(
+            self._get_receipts_to_download().mapped('image_url'))
+
+    def _prepare_processing_batch(self):
+        """The returned dict is shared by all the transactions processed
+        together by process_line() (key 'newgen_batch' of the context)"""
+        batch = {
+            # key = company ID, value = processing context
+            'companies': {},
+            'profiler': self._is_processing_profiled() and ProcessingProfiler() or None,
+            }
+        self = self.with_context(newgen_batch=batch)
+        with self._profile('receipt_download', len(self._get_receipts_to_download())):
+            batch['receipts'] = self._prefetch_receipts()
+            batch['receipt_attachments'] = self.env[
+                'newgen.payment.card.receipt']._get_image_attachments(
+                    list(batch['receipts']))
+        return batch
+
+    @api.model
+    def _is_processing_profiled(self):
+        return self.env.context.get('newgen_profile') or str2bool(
+            self.env['ir.config_parameter'].sudo().get_param(
+                'newgen_payment_card.processing_profiling', 'False'))
+
+    @contextmanager
+    def _profile(self, stage, count=1):
+        """Record the time and the queries spent in the block when
+        process_line() is profiled"""
+        profiler = (self.env.context.get('newgen_batch') or {}).get('profiler')
+        if not profiler:
+            yield
+            return
+        with profiler.stage(stage, self.env.cr, count=count):
+            yield
+
+    def _get_processing_context(self):
+        """Returns the processing context of the company of the transaction.
+        It is built once per company for all the transactions processed
+        together by process_line()"""
+        self.ensure_one()
+        batch = self.env.context.get('newgen_batch')
+        if batch is None:
+            return self._prepare_processing_context(self.company_id)
+        companies = batch.setdefault('companies', {})
+        if self.company_id.id not in companies:
+            companies[self.company_id.id] = self._prepare_processing_context(
+                self.company_id)
+        return companies[self.company_id.id]
+
+    @api.model
+    def _prepare_processing_context(self, company):
+        # This method is inherited in l10n_fr_base_newgen_payment_card
+        ato = self.env['account.tax']
+        purchase_taxes = ato.search([
+            ('company_id', '=', company.id),
+            ('type_tax_use', '=', 'purchase'),
+            ('unece_type_code', '=', 'VAT'),
+            ('amount_type', '=', 'percent'),
+            ('amount', '>', 0),
+            ], order='amount desc')
+        autoliquidation_taxes = {}
+        for tax in purchase_taxes:
+            if hasattr(ato, 'fr_vat_autoliquidation') and not tax.fr_vat_autoliquidation:
                 continue
+            autoliquidation_taxes.setdefault(tax.unece_categ_code, tax)
+        purchase_journal = self.env['account.journal'].search([
+            ('company_id', '=', company.id),
+            ('type', '=', 'purchase'),
+            ], limit=1)
+        return {
+            'purchase_taxes': purchase_taxes,
+            # key = UNECE tax category code, value = tax with the highest rate
+            'autoliquidation_taxes': autoliquidation_taxes,
+            # key = tax dict returned by _prepare_regular_taxes(), value = tax
+            'tax_matches': {},
+            'purchase_journal': purchase_journal,
+            'transaction_type_labels': dict(
+                self._fields['transaction_type']._description_selection(self.env)),
+            'uom_unit': self.env.ref('uom.product_uom_unit'),
+            }
+
+    def _download_receipt(self, url):
+        """Returns the receipt ready to be attached to the invoice, taken
+        from the receipts downloaded in advance by process_line()
+        when possible"""
+        return self._get_receipt_download(url).content
+
+    def _get_receipt_download(self, url):
+        self.ensure_one()
+        batch = self.env.context.get('newgen_batch') or {}
+        download = batch.get('receipts', {}).get(url)
+        if download is None:
+            with self._profile('receipt_download'):
+                download = self._fetch_receipts([url])[url]
+        if download.error:
+            raise UserError(_(
+                "Failed to download the image of the receipt. "
+                "Error message: %s.") % download.error)
+        if download.status_code != 200:
+            raise UserError(_(
+                "Could not download the image of transaction %s "
+                "from URL %s (HTTP error code %s).")
+                % (self.name, url, download.status_code))
+        return download
+
+    def _get_receipt_attachment(self, url):
+        """Returns the attachment of the receipt cache holding the receipt
+        of the URL (empty recordset if there is none)"""
+        batch = self.env.context.get('newgen_batch') or {}
+        receipt_attachments = batch.get('receipt_attachments')
+        if receipt_attachments is None or url not in receipt_attachments:
+            receipt_attachments = self.env[
+                'newgen.payment.card.receipt']._get_image_attachments([url])
+        return receipt_attachments.get(url) or self.env['ir.attachment']
+
+    @api.depends('vendor')
+    def _compute_vendor_label(self):
+        npcplo = self.env['newgen.payment.card.partner.label']
+        for trans in self:
+            trans.vendor_label = trans.vendor and npcplo._normalize_label(
+                trans.vendor) or False
+
+    def _get_partner_label_key(self):
+        self.ensure_one()
+        return (
+            self.state, self.transaction_type, self.vendor_label,
+            self.partner_id.id)
+
+    def write(self, vals):
+        if 'processing_error' not in vals and any(self.mapped('processing_error')):
+            vals = dict(vals, processing_error=False)
+        update_labels = (
+            PARTNER_LABEL_FIELDS.intersection(vals) and
+            not self.env.context.get('newgen_skip_partner_labels'))
+        if update_labels:
+            old_keys = {
+                trans.id: trans._get_partner_label_key() for trans in self}
+        res = super().write(vals)
+        if update_labels:
+            # the imports write the partner of draft transactions,
+            # most of the time without changing it
+            self.filtered(
+                lambda x: x._get_partner_label_key() != old_keys[x.id]
+                )._update_partner_labels()
+        return res
+
+    def _update_partner_labels(self):
+        self.env['newgen.payment.card.partner.label'].sudo()\
+            ._update_from_transactions(self)
+
+    @api.model
+    def _get_ready_to_process_domain(self):
+        return [
+            ('state', '=', 'draft'),
+            ('processing_error', '=', False),
+            '|',
+            ('transaction_type', '=', 'load'),
+            '&', '&', '&',
+            ('transaction_type', '=', 'expense'),
+            ('expense_account_id', '!=', False),
+            ('description', '!=', False),
+            '|', '|',
+            ('bank_move_only', '=', True),
+            ('image_url', '!=', False),
+            ('receipt_lost', '=', True),
+            ]
+
+    @api.model
+    def _trigger_processing(self):
+        cron = self.env.ref(
+            'base_newgen_payment_card.newgen_payment_card_transaction_process_cron',
+            raise_if_not_found=False)
+        if cron and cron.active:
+            cron._trigger()
+
+    @api.model
+    def _cron_process_transactions(self):
+        """Process one batch of ready transactions, then trigger the
+        scheduled action again for the next batch. Each batch is processed
+        in its own transaction, within the limits of workers and database
+        connections of the server. Odoo never runs the same scheduled action
+        twice at the same time, so the batches are processed one after the
+        other"""
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            'newgen_payment_card.processing_batch_size',
+            DEFAULT_PROCESSING_BATCH_SIZE))
+        try:
+            trans = self._claim_transactions_to_process(batch_size)
+        except pg_errors.SerializationFailure:
+            # processed by a user since the start of the transaction
+            # of the scheduled action: try again in the next run
+            self.env.cr.rollback()
+            self._trigger_processing()
+            return
+        if not trans:
+            return
+        trans._process_claimed_transactions()
+        if self.search(self._get_ready_to_process_domain() + [
+                ('id', 'not in', trans.ids)], limit=1):
+            self._trigger_processing()
+
+    @api.model
+    def _claim_transactions_to_process(self, limit):
+        """Lock the next transactions ready to be processed. The lock is
+        kept until the commit, so the transactions that a user is
+        processing at the same time are skipped, and a user can't process
+        the locked ones"""
+        self.flush_model()
+        query = self._where_calc(self._get_ready_to_process_domain())
+        query.order = '"newgen_payment_card_transaction".id'
+        query.limit = limit
+        query_str, params = query.select('"newgen_payment_card_transaction".id')
+        self.env.cr.execute(query_str + ' FOR UPDATE SKIP LOCKED', params)
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def _process_claimed_transactions(self):
+        """Process the transactions by company. If a batch fails, its
+        transactions are processed one by one and the error is stored
+        on the failing ones"""
+        for company in self.company_id:
+            batch = self.filtered(lambda x: x.company_id == company).with_company(
+                company)
+            logger.info(
+                'Processing %d payment card transactions of company %s',
+                len(batch), company.display_name)
+            try:
+                with self.env.cr.savepoint():
+                    batch.process_line()
+                continue
+            except Exception as e:
+                logger.info(
+                    'Batch processing of payment card transactions failed (%s): '
+                    'processing them one by one', e)
+            for trans in batch:
+                try:
+                    with self.env.cr.savepoint():
+                        trans.process_line()
+                except Exception as e:
+                    logger.warning(
+                        'Processing of payment card transaction %s failed: %s',
+                        trans.name, e)
+                    trans.write({'processing_error': str(e)})
+
+    def _lock_for_processing(self):
+        """Lock the transactions, so that they can't be processed
+        at the same time by another user or by the scheduled action"""
+        if not self.ids:
+            return
+        self.flush_recordset()
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute(
+                    "SELECT id FROM newgen_payment_card_transaction "
+                    "WHERE id IN %s FOR UPDATE NOWAIT", (tuple(self.ids), ))
+        except pg_errors.LockNotAvailable:
+            raise UserError(_(
+                "Some of the selected transactions are currently being "
+                "processed by another user or by the scheduled action. "
+                "Try again in a few minutes."))
+        # the state in cache may be older than the lock
+        self.invalidate_recordset(['state'])
+
+    def process_line(self):
+        self._lock_for_processing()
+        lines = self.filtered(lambda x: x.state == 'draft')
+        for line in self - lines:
+            logger.warning(
+                'Skipping transaction %s which is not draft',
+                line.name)
+        batch = lines._prepare_processing_batch()
+        lines = lines.with_context(newgen_batch=batch)
+        with lines._profile('bank_move', len(lines)):
+            bank_moves = lines._generate_bank_journal_moves()
+        invoices = lines.filtered(
+            lambda x: x.transaction_type == 'expense' and
+            not x.bank_move_only and not x.invoice_id)._generate_invoices()
+        line_vals = []
+        to_reconcile = []
+        for line in lines:
             vals = {'state': 'done'}
-            bank_move = line.generate_bank_journal_move()
+            bank_move = bank_moves[line.id]
             vals['bank_move_id'] = bank_move.id
             if line.transaction_type == 'expense':
                 if not line.bank_move_only:
                     if line.invoice_id:
-                        self.check_existing_invoice()
+                        line.check_existing_invoice()
                         invoice = line.invoice_id
                     else:
-                        invoice = line.generate_invoice()
+                        invoice = invoices[line.id]
                         vals['invoice_id'] = invoice.id
-                    rec = line.reconcile(bank_move, invoice)
-                    vals['reconcile_id'] = rec.id
-            line.write(vals)
+                    to_reconcile.append((line, bank_move, invoice))
+            line_vals.append((line, vals))
+        with lines._profile('write', len(lines)):
+            for line, vals in line_vals:
+                line.with_context(newgen_skip_partner_labels=True).write(vals)
+            lines._update_partner_labels()
+        # reconcile_id is updated by its compute
+        with lines._profile('reconcile', len(to_reconcile)):
+            lines._reconcile_batch(to_reconcile)
+        if batch['profiler']:
+            lines._save_processing_run(batch['profiler'])
         return True
 
+    def _save_processing_run(self, profiler):
+        logger.info(
+            'Processed %d payment card transactions in %.2fs (%s)',
+            len(self), profiler.duration, profiler.summary())
+        self.env['newgen.payment.card.processing.run'].sudo()._create_from_profiler(
+            profiler, len(self))
+
     def _prepare_bank_journal_move(self):
         self.ensure_one()
         amount = self.total_company_currency
@@ -279,10 +643,8 @@ class NewgenPaymentCardTransaction(models.Model):
             raise UserError(_(
                 "Counter-part of Bank Move is empty "
                 "on transaction %s.") % self.name)
-        transaction_type = dict(
-            self.fields_get(
-                'transaction_type',
-                'selection')['transaction_type']['selection'])[self.transaction_type]
+        transaction_type = self._get_processing_context()[
+            'transaction_type_labels'][self.transaction_type]
         ref = '%s (%s)' % (self.name, transaction_type)
         if self.transaction_type == 'expense':
             partner_id = self.partner_id.id
@@ -311,10 +673,25 @@ class NewgenPaymentCardTransaction(models.Model):
 
     def generate_bank_journal_move(self):
         self.ensure_one()
-        vals = self._prepare_bank_journal_move()
-        bank_move = self.env['account.move'].create(vals)
-        bank_move._post(soft=False)
-        return bank_move
+        return self._generate_bank_journal_moves()[self.id]
+
+    def _generate_bank_journal_moves(self):
+        """Create the bank moves of the transactions with one multi-create
+        per bank journal and post them together.
+        Returns a dict with key = transaction ID and value = bank move"""
+        trans_vals_by_journal = defaultdict(list)
+        for trans in self:
+            vals = trans._prepare_bank_journal_move()
+            trans_vals_by_journal[vals['journal_id']].append((trans, vals))
+        res = {}
+        for trans_vals in trans_vals_by_journal.values():
+            bank_moves = self.env['account.move'].create(
+                [vals for (trans, vals) in trans_vals])
+            bank_moves._post(soft=False)
+            # create() returns the moves in the order of vals_list
+            for (trans, vals), bank_move in zip(trans_vals, bank_moves):
+                res[trans.id] = bank_move
+        return res
 
     def _countries_vat_refund(self):
         return self.company_id.country_id
@@ -322,22 +699,12 @@ class NewgenPaymentCardTransaction(models.Model):
     def _prepare_autoliquidation_taxes(self):
         self.ensure_one()
         assert self.autoliquidation in ('intracom', 'extracom')
-        ato = self.env["account.tax"]
         autoliq2categ = {
             'intracom': 'K',
             'extracom': 'G',
             }
-        domain = [
-            ('company_id', '=', self.company_id.id),
-            ('type_tax_use', '=', 'purchase'),
-            ('unece_type_code', '=', 'VAT'),
-            ('amount_type', '=', 'percent'),
-            ('amount', '>', 0),
-            ('unece_categ_code', '=', autoliq2categ[self.autoliquidation]),
-            ]
-        if hasattr(ato, 'fr_vat_autoliquidation'):
-            domain.append(('fr_vat_autoliquidation', '=', True))
-        tax = ato.search(domain, order='amount desc', limit=1)
+        tax = self._get_processing_context()['autoliquidation_taxes'].get(
+            autoliq2categ[self.autoliquidation])
         if not tax:
             raise UserError(_(
                 "Odoo could not find any %s auto-liquidation tax properly configured "
@@ -419,7 +786,7 @@ class NewgenPaymentCardTransaction(models.Model):
                 'price_unit': price_unit,
                 'name': self.description,
                 'qty': qty,
-                'uom': {'recordset': self.env.ref('uom.product_uom_unit')},
+                'uom': {'recordset': self._get_processing_context()['uom_unit']},
                 }],
             'origin': origin,
             }
@@ -435,49 +802,95 @@ class NewgenPaymentCardTransaction(models.Model):
                 "as 'Receipt Lost'.")
                 % self.name)
 
+        # The files are read only by generate_invoice(), for
+        # account_invoice_import. The direct invoice engine shares them
         parsed_inv['attachments'] = {}
+        parsed_inv['attachment_sources'] = {}
         if url:
-            try:
-                rimage = requests.get(url, timeout=TIMEOUT)
-            except Exception as e:
-                raise UserError(_(
-                    "Failed to download the image of the receipt. "
-                    "Error message: %s.") % e)
-            if rimage.status_code != 200:
-                raise UserError(_(
-                    "Could not download the image of transaction %s "
-                    "from URL %s (HTTP error code %s).")
-                    % (self.name, url, rimage.status_code))
-            image_binary = rimage.content
+            # JPG images are already rotated
+            download = self._get_receipt_download(url)
             file_extension = os.path.splitext(urlparse(url).path)[1]
             logger.debug('file_extension=%s', file_extension)
-            if file_extension in ('.JPG', '.JPEG', '.jpg', '.jpeg'):
-                logger.debug('Trying to rotate the JPG image %s', url)
-                try:
-                    image_binary = self._rotate_image(image_binary)
-                    logger.info('JPEG file successfully rotated')
-                except Exception as e:
-                    logger.info('Failed to rotate the image. Error: %s', e)
-                    pass
             filename = 'Receipt-%s%s' % (self.name, file_extension)
-            image_b64 = base64.encodebytes(image_binary)
-            parsed_inv['attachments'] = {filename: image_b64}
-        if attachments:
-            for att in attachments:
-                parsed_inv['attachments'][att.name] = att.datas
+            parsed_inv['attachment_sources'][filename] = (
+                self._get_receipt_attachment(url) or download.content)
+        for att in attachments:
+            parsed_inv['attachment_sources'][att.name] = att
         # TODO: delete attachments on transaction once invoice is created ?
         return parsed_inv
 
+    @api.model
+    def _encode_invoice_attachments(self, attachment_sources):
+        """Returns a dict with key = filename and value = file in base64
+        from the dict returned in parsed_inv['attachment_sources']"""
+        res = {}
+        for filename, source in attachment_sources.items():
+            if isinstance(source, bytes):
+                res[filename] = base64.encodebytes(source)
+            else:
+                res[filename] = source.sudo().datas
+        return res
+
+    @api.model
+    def _prepare_invoice_attachment_vals(self, attachment_sources, invoice):
+        """The value of attachment_sources is an ir.attachment or the raw
+        file. Returns a list of (vals, source) where source is the
+        ir.attachment whose file is given to the new attachment by
+        _create_invoice_attachments() (None for a raw file)"""
+        res = []
+        for filename, source in attachment_sources.items():
+            vals = {
+                'name': filename,
+                'res_model': 'account.move',
+                'res_id': invoice.id,
+                'company_id': invoice.company_id.id,
+                }
+            if isinstance(source, bytes):
+                vals['raw'] = source
+                res.append((vals, None))
+            else:
+                source = source.sudo()
+                vals['mimetype'] = source.mimetype
+                res.append((vals, source))
+        return res
+
+    @api.model
+    def _create_invoice_attachments(self, vals_sources):
+        """Creates the attachments from the list returned by
+        _prepare_invoice_attachment_vals(). create() ignores the file
+        columns (store_fname, checksum...), so the attachments created
+        from an ir.attachment point to its file with a SQL query, without
+        reading the file: the filestore keeps a file as long as an
+        attachment refers to it"""
+        attachments = self.env['ir.attachment'].create(
+            [vals for (vals, source) in vals_sources])
+        links = [
+            (attachment.id, source.id)
+            for attachment, (vals, source) in zip(attachments, vals_sources)
+            if source]
+        if links:
+            self.env['ir.attachment'].flush_model()
+            self.env.cr.execute("""
+                UPDATE ir_attachment AS att
+                SET store_fname=src.store_fname, db_datas=src.db_datas,
+                    checksum=src.checksum, file_size=src.file_size,
+                    index_content=src.index_content
+                FROM unnest(%s, %s) AS link(att_id, src_id)
+                JOIN ir_attachment AS src ON src.id=link.src_id
+                WHERE att.id=link.att_id""", (
+                [att_id for (att_id, src_id) in links],
+                [src_id for (att_id, src_id) in links]))
+            attachments.invalidate_recordset()
+        return attachments
+
     @api.model
     def _rotate_image(self, image_binary):
-        image_original_file = io.BytesIO()
-        image_original_file.write(image_binary)
-        original_image = Image.open(image_original_file)
-        rotated_image = ImageOps.exif_transpose(original_image)
-        rotated_image_file = io.BytesIO()
-        rotated_image.save(rotated_image_file, format='JPEG')
-        rotated_image_binary = rotated_image_file.getvalue()
-        return rotated_image_binary
+        ico = self.env['ir.config_parameter'].sudo()
+        return normalize_jpeg(
+            image_binary,
+            max_dimension=int(ico.get_param(
+                'newgen_payment_card.receipt_max_dimension', 0)),
+            quality=int(ico.get_param('newgen_payment_card.receipt_jpeg_quality', 0)))
 
     def check_existing_invoice(self):
         assert self.invoice_id
@@ -541,6 +954,8 @@ class NewgenPaymentCardTransaction(models.Model):
         assert self.transaction_type == 'expense', 'wrong transaction type'
         aiio = self.env['account.invoice.import']
         parsed_inv = self._prepare_invoice_import()
+        parsed_inv['attachments'].update(self._encode_invoice_attachments(
+            parsed_inv.pop('attachment_sources', {})))
         logger.debug('Payment card invoice import parsed_inv=%s', parsed_inv)
         parsed_inv = aiio.pre_process_parsed_inv(parsed_inv)
         import_config = self._prepare_invoice_import_config()
@@ -554,65 +969,428 @@ class NewgenPaymentCardTransaction(models.Model):
             invoice.amount_tax, abs(self.vat_company_currency)) == 0, 'bug on VAT'
         return invoice
 
+    @api.model
+    def _get_invoice_engine(self):
+        return self.env['ir.config_parameter'].sudo().get_param(
+            'newgen_payment_card.invoice_engine', DEFAULT_INVOICE_ENGINE)
+
+    def _generate_invoices(self):
+        """Generate the supplier invoices/refunds of the transactions.
+        Returns a dict with key = transaction ID and value = invoice"""
+        if 'newgen_batch' not in self.env.context:
+            self = self.with_context(newgen_batch={})
+        if self._get_invoice_engine() != 'direct':
+            res = {}
+            for trans in self:
+                with trans._profile('generate_invoice'):
+                    res[trans.id] = trans.generate_invoice()
+            return res
+        res = {}
+        for trans_ids in split_every(INVOICE_CREATE_CHUNK_SIZE, self.ids):
+            res.update(self.browse(trans_ids)._generate_invoices_direct())
+        return res
+
+    def _generate_invoices_direct(self):
+        """Build the invoice vals from the same parsed_inv and import_config
+        as generate_invoice(), without the generic pipeline of
+        account_invoice_import, and create and post the invoices together.
+        If the VAT amount computed by Odoo doesn't match the VAT amount
+        of a transaction, the invoice of that transaction is generated
+        by account_invoice_import, which adjusts the tax line."""
+        trans_vals = []
+        for trans in self:
+            assert trans.transaction_type == 'expense', 'wrong transaction type'
+            with trans._profile('invoice_prepare'):
+                parsed_inv = trans._prepare_invoice_import()
+                logger.debug('Payment card invoice import parsed_inv=%s', parsed_inv)
+                import_config = trans._prepare_invoice_import_config()
+                vals = trans._prepare_invoice_vals(parsed_inv, import_config)
+            trans_vals.append((trans, vals, parsed_inv['attachment_sources']))
+        with self._profile('invoice_create', len(self)):
+            invoices = self.env['account.move'].create(
+                [vals for (trans, vals, attachments) in trans_vals])
+        res = {}
+        to_post = self.env['account.move']
+        fallback = self.env['newgen.payment.card.transaction']
+        attach_vals_sources = []
+        # create() returns the invoices in the order of vals_list
+        for (trans, vals, attachments), invoice in zip(trans_vals, invoices):
+            if trans.company_currency_id.compare_amounts(
+                    invoice.amount_tax, abs(trans.vat_company_currency)):
+                logger.info(
+                    'VAT amount of invoice of transaction %s is %s instead of %s: '
+                    'generating it with account_invoice_import',
+                    trans.name, invoice.amount_tax, abs(trans.vat_company_currency))
+                fallback |= trans
+                continue
+            attach_vals_sources += trans._prepare_invoice_attachment_vals(
+                attachments, invoice)
+            to_post |= invoice
+            res[trans.id] = invoice
+        with self._profile('invoice_create', 0):
+            (invoices - to_post).unlink()
+            self._create_invoice_attachments(attach_vals_sources)
+            for trans in self:
+                if trans.id in res:
+                    res[trans.id].message_post(
+                        body=_("Invoice created from payment card transaction %s.")
+                        % trans.name)
+        with self._profile('invoice_post', len(to_post)):
+            to_post.with_context(validate_analytic=True)._post(soft=False)
+        for trans in fallback:
+            with trans._profile('generate_invoice'):
+                res[trans.id] = trans.generate_invoice()
+        return res
+
+    def _prepare_invoice_vals(self, parsed_inv, import_config):
+        self.ensure_one()
+        move_type = 'in_invoice'
+        if self.company_currency_id.compare_amounts(parsed_inv['amount_total'], 0) < 0:
+            move_type = 'in_refund'
+        line_vals_list = []
+        for parsed_line in parsed_inv['lines']:
+            taxes = self._match_invoice_taxes(parsed_line['taxes'])
+            line_vals = self._prepare_invoice_line_vals(
+                parsed_line, import_config, taxes)
+            if move_type == 'in_refund':
+                line_vals['quantity'] *= -1
+            line_vals_list.append((0, 0, line_vals))
+        vals = {
+            'move_type': move_type,
+            'company_id': self.company_id.id,
+            'partner_id': parsed_inv['partner']['recordset'].id,
+            'currency_id': parsed_inv['currency']['recordset'].id,
+            'invoice_date': parsed_inv['date'],
+            'invoice_date_due': parsed_inv['date_due'],
+            'invoice_payment_term_id': False,
+            'ref': parsed_inv['invoice_number'],
+            'invoice_origin': parsed_inv['origin'],
+            'invoice_line_ids': line_vals_list,
+            }
+        purchase_journal = self._get_processing_context()['purchase_journal']
+        if purchase_journal:
+            vals['journal_id'] = purchase_journal.id
+        return vals
+
+    @api.model
+    def _prepare_invoice_line_vals(self, parsed_line, import_config, taxes):
+        # This method is inherited in base_newgen_payment_card_start_end_dates
+        vals = {
+            'name': parsed_line['name'],
+            'account_id': import_config['account'].id,
+            'analytic_distribution': import_config.get('analytic_distribution') or False,
+            'quantity': parsed_line['qty'],
+            'price_unit': parsed_line['price_unit'],
+            'product_uom_id': parsed_line['uom']['recordset'].id,
+            'tax_ids': [(6, 0, taxes.ids)],
+            }
+        return vals
+
+    def _match_invoice_taxes(self, taxes):
+        """Returns the account.tax recordset matching the list of tax dicts
+        returned by _prepare_regular_taxes() or _prepare_autoliquidation_taxes()"""
+        self.ensure_one()
+        ato = self.env['account.tax']
+        tax_matches = self._get_processing_context()['tax_matches']
+        res = ato
+        for tax in taxes:
+            if tax.get('id'):
+                res |= ato.browse(tax['id'])
+                continue
+            key = tuple(sorted(tax.items()))
+            if key not in tax_matches:
+                tax_matches[key] = ato.search([
+                    ('company_id', '=', self.company_id.id),
+                    ('type_tax_use', '=', 'purchase'),
+                    ('price_include', '=', False),
+                    ('amount_type', '=', tax['amount_type']),
+                    ('amount', '=', tax['amount']),
+                    ('unece_type_code', '=', tax['unece_type_code']),
+                    ('unece_categ_code', '=', tax['unece_categ_code']),
+                    ], limit=1)
+            if not tax_matches[key]:
+                raise UserError(_(
+                    "Odoo could not find any purchase tax with a rate of "
+                    "%s %% in company '%s' for transaction %s.") % (
+                        tax['amount'], self.company_id.display_name, self.name))
+            res |= tax_matches[key]
+        return res
+
     def reconcile(self, bank_move, invoice):
         self.ensure_one()
-        assert self.bank_counterpart_account_id
-        assert bank_move
-        assert invoice
-        assert not self.reconcile_id, 'already has a reconcile mark'
-        movelines_to_rec = self.env['account.move.line'].search([
-            ('move_id', '=', bank_move.id),
-            ('account_id', '=', self.bank_counterpart_account_id.id),
-            ], limit=1)
-        for line in invoice.line_ids:
-            if line.account_id == self.bank_counterpart_account_id:
-                movelines_to_rec += line
-        movelines_to_rec.reconcile()
-        return movelines_to_rec[0].full_reconcile_id
+        return self._reconcile_batch([(self, bank_move, invoice)])[self.id]
 
     @api.model
-    def _prepare_import_speeddict(self, company):
-        """Used in provided-specific modules"""
-        bdio = self.env['business.document.import']
-        speeddict = {
-            'tokens': {}, 'accounts': {}, 'analytic': {},
-            'countries': {}, 'currencies': {}, 'mapping': {}}
+    def _reconcile_batch(self, to_reconcile):
+        """to_reconcile is a list of (transaction, bank_move, invoice).
+        Reconcile the counter-part line of each bank move with the
+        payable line of its invoice, with one call per counter-part account.
+        Returns a dict with key = transaction ID and value = full reconcile"""
+        amlo = self.env['account.move.line']
+        plans = defaultdict(list)
+        for trans, bank_move, invoice in to_reconcile:
+            account = trans.bank_counterpart_account_id
+            assert account
+            assert bank_move
+            assert invoice
+            assert not trans.reconcile_id, 'already has a reconcile mark'
+            # bank_move.line_ids is already in cache: no need to search
+            movelines_to_rec = bank_move.line_ids.filtered(
+                lambda x: x.account_id == account)[:1]
+            movelines_to_rec |= invoice.line_ids.filtered(
+                lambda x: x.account_id == account)
+            plans[account].append((trans, movelines_to_rec))
+        res = {}
+        for account, trans_movelines in plans.items():
+            logger.debug(
+                'Reconciling %d pairs of move lines on account %s',
+                len(trans_movelines), account.code)
+            # Each pair must get its own full reconcile: calling reconcile()
+            # on the union of the pairs would reconcile them all together
+            if hasattr(amlo, '_reconcile_plan'):
+                amlo._reconcile_plan(
+                    [movelines for (trans, movelines) in trans_movelines])
+            else:
+                for trans, movelines in trans_movelines:
+                    movelines.reconcile()
+            for trans, movelines in trans_movelines:
+                res[trans.id] = movelines[0].full_reconcile_id
+        return res
+
+    @api.model
+    def _import_speeddict_parts(self):
+        """Returns a dict with key = part of the speeddict and
+        value = list of the models it is built from. Each part is cached
+        separately and rebuilt only when one of its models changed."""
+        return {
+            'tokens': ['newgen.payment.card'],
+            'accounts': ['account.account'],
+            'analytic': ['account.analytic.account'],
+            'countries': ['res.country', 'res.country.group'],
+            'currencies': ['res.currency'],
+            'mapping': ['newgen.payment.card.account.mapping'],
+            'partner_labels': ['newgen.payment.card.partner.label'],
+            'partners': ['res.partner'],
+            }
 
-        token_res = self.env['newgen.payment.card'].search_read(
-            [('company_id', '=', company.id)], ['name'])
+    @api.model
+    def _import_speeddict_key_parts(self):
+        """Parts of the speeddict that can be restricted to the keys
+        found in the imported file (see _prepare_import_speeddict()).
+        For the other parts, the whole table is needed: accounts are matched
+        by prefix and partners by name with the 'contain' rule."""
+        return ['tokens', 'analytic', 'countries', 'currencies', 'partner_labels']
+
+    @api.model
+    def _search_read_normalized_in(self, model_name, field_name, values, domain):
+        """Returns a dict with key = value of the field stripped and
+        lowercased and value = ID, for the records whose field is
+        one of values (already stripped and lowercased)"""
+        model = self.env[model_name]
+        model.flush_model([field_name])
+        res = {}
+        for values_chunk in split_every(IMPORT_KEY_SEARCH_CHUNK, set(values)):
+            query = model._where_calc(domain)
+            model._apply_ir_rules(query, 'read')
+            # the values are compared as they are matched in the file,
+            # so the stored values are stripped and lowercased too
+            column = '"%s"."%s"' % (model._table, field_name)
+            query.add_where(
+                'lower(trim(%s)) IN %%s' % column, [tuple(values_chunk)])
+            # same order as the search_read of the whole table,
+            # the last record wins when several have the same value
+            query.order = model._generate_order_by(None, query).replace(
+                ' ORDER BY ', '')
+            query_str, params = query.select(
+                '"%s".id' % model._table, 'lower(trim(%s))' % column)
+            self.env.cr.execute(query_str, params)
+            for record_id, value in self.env.cr.fetchall():
+                res[value] = record_id
+        return res
+
+    @api.model
+    def _import_speeddict_stamp_where(self):
+        """Returns a dict with key = model and value = SQL condition on
+        the rows read by the cached parts of the speeddict, so that the
+        other rows don't change the stamp"""
+        # the contacts of the partners are not matched
+        return {'res.partner': 'parent_id IS NULL'}
+
+    @api.model
+    def _import_speeddict_stamp(self, model_names):
+        """The stamp changes whenever a record of one of the models is
+        created, written or deleted, in this worker or in another one.
+        The new IDs are greater than the deleted ones, so max(id) changes
+        when records are deleted and others created."""
+        stamp_where = self._import_speeddict_stamp_where()
+        stamp = []
+        for model_name in model_names:
+            model = self.env[model_name]
+            model.flush_model()
+            query = 'SELECT count(*), max(id), max(write_date) FROM "%s"' % (
+                model._table)
+            if model_name in stamp_where:
+                query += ' WHERE %s' % stamp_where[model_name]
+            self.env.cr.execute(query)
+            stamp.append(self.env.cr.fetchone())
+        return tuple(stamp)
+
+    def _prepare_import_speeddict_tokens(self, company, keys=None):
+        res = {'tokens': {}}
+        domain = [('company_id', '=', company.id)]
+        if keys is not None:
+            domain.append(('name', 'in', list(keys.get('tokens', []))))
+        # archived cards included: a token is unique in a company
+        token_res = self.env['newgen.payment.card'].with_context(
+            active_test=False).search_read(domain, ['name'])
         for token in token_res:
-            speeddict['tokens'][token['name']] = token['id']
+            res['tokens'][token['name']] = token['id']
+        return res
 
-        speeddict['accounts'] = bdio._prepare_account_speed_dict()
+    def _prepare_import_speeddict_accounts(self, company):
+        bdio = self.env['business.document.import']
+        return {'accounts': bdio._prepare_account_speed_dict()}
 
+    def _prepare_import_speeddict_analytic(self, company, keys=None):
+        domain = [('company_id', '=', company.id), ('code', '!=', False)]
+        if keys is not None:
+            return {'analytic': self._search_read_normalized_in(
+                'account.analytic.account', 'code', keys.get('analytic', []),
+                domain)}
+        res = {'analytic': {}}
         analytic_res = self.env['account.analytic.account'].search_read(
-            [('company_id', '=', company.id), ('code', '!=', False)], ['code'])
+            domain, ['code'])
         for analytic in analytic_res:
             analytic_code = analytic['code'].strip().lower()
-            speeddict['analytic'][analytic_code] = analytic['id']
+            res['analytic'][analytic_code] = analytic['id']
+        return res
 
-        countries = self.env['res.country'].search_read(
-            [('code', '!=', False)], ['code'])
+    def _prepare_import_speeddict_countries(self, company, keys=None):
+        res = {'countries': {}}
+        domain = [('code', '!=', False)]
+        if keys is not None:
+            domain.append(('code', 'in', list(keys.get('countries', []))))
+        countries = self.env['res.country'].search_read(domain, ['code'])
         for country in countries:
-            speeddict['countries'][country['code'].strip()] = country['id']
-        speeddict['eu_country_ids'] = self.env.ref('base.europe').country_ids.ids
-        if not company.country_id.id:
-            raise UserError(_(
-                "Country is not set on company '%s'.") % company.display_name)
-        speeddict['my_country_id'] = company.country_id.id
+            res['countries'][country['code'].strip()] = country['id']
+        res['eu_country_ids'] = self.env.ref('base.europe').country_ids.ids
+        return res
 
+    def _prepare_import_speeddict_currencies(self, company, keys=None):
+        res = {'currencies': {}}
+        domain = []
+        if keys is not None:
+            domain.append(('name', 'in', list(keys.get('currencies', []))))
         currencies = self.env['res.currency'].with_context(
-            active_test=False).search_read([], ['name'])
+            active_test=False).search_read(domain, ['name'])
         for curr in currencies:
-            speeddict['currencies'][curr['name']] = curr['id']
-        npcto = self.env['newgen.payment.card.transaction']
+            res['currencies'][curr['name']] = curr['id']
+        return res
+
+    def _prepare_import_speeddict_mapping(self, company):
+        res = {'mapping': {}}
         map_res = self.env['newgen.payment.card.account.mapping'].search_read(
             [('company_id', '=', company.id)])
         for map_entry in map_res:
-            speeddict['mapping'][
+            res['mapping'][
                 (map_entry['card_id'][0],
                  map_entry['expense_account_id'][0])] =\
                 map_entry['force_expense_account_id'][0]
+        return res
+
+    def _prepare_import_speeddict_partner_labels(self, company, keys=None):
+        """Labels are matched in all the companies of the user, like
+        the transactions they come from"""
+        res = {'partner_labels': {}}
+        npcplo = self.env['newgen.payment.card.partner.label']
+        domain = [('company_id', 'in', self.env.companies.ids)]
+        fields_list = ['label', 'partner_id', 'transaction_id']
+        if keys is None:
+            labels = npcplo.search_read(domain, fields_list)
+        else:
+            labels = []
+            for labels_chunk in split_every(
+                    IMPORT_KEY_SEARCH_CHUNK, keys.get('partner_labels', []),
+                    list):
+                labels += npcplo.search_read(
+                    domain + [('label', 'in', labels_chunk)], fields_list)
+        # order by transaction to have the latest value for a label
+        # present in several companies
+        labels.sort(key=lambda x: x['transaction_id'][0])
+        for label in labels:
+            res['partner_labels'][label['label']] = label['partner_id'][0]
+        return res
+
+    def _prepare_import_speeddict_partners(self, company):
+        res = {'partner_vat': {}, 'partner_names': {}}
+        partners = self.env['res.partner'].search_read(
+            [('parent_id', '=', False), ('id', '!=', company.partner_id.id)],
+            ['name', 'vat'])
+        for partner in partners:
+            partner_name = unidecode(partner['name'].strip().upper())
+            if len(partner_name) >= MEANINGFUL_PARTNER_NAME_MIN_SIZE:
+                res['partner_names'][partner_name] = partner['id']
+            if partner['vat']:
+                # 'vat' field is already sanitized
+                res['partner_vat'][partner['vat']] = partner['id']
+        # Index used to match on partner name with the 'contain' and
+        # 'equal' rules without looping on all partners for each vendor
+        res['partner_name_index'] = PartnerNameIndex(
+            res['partner_names'].items())
+        return res
+
+    @api.model
+    def _get_import_speeddict_parts(self, company, keys=None):
+        """Returns the cacheable parts of the speeddict, reusing the
+        parts built by a previous import when their source models
+        have not changed. When keys is given, the parts that can be
+        restricted to the keys of the file are built for them only
+        (and are not cached)"""
+        key = (self.env.cr.dbname, company.id)
+        # the result depends on the access rights and multi-company rules:
+        # the speeddict of another user replaces it, so that the worker
+        # keeps one speeddict per company
+        access = (self.env.uid, tuple(self.env.companies.ids))
+        entry = speeddict_cache.get(key)
+        if (
+                entry is None or entry.get('access') != access or
+                self.env.context.get('newgen_speeddict_no_cache')):
+            entry = {'access': access}
+        res = {}
+        key_parts = keys is not None and self._import_speeddict_key_parts() or []
+        for part, model_names in self._import_speeddict_parts().items():
+            if part in key_parts:
+                logger.debug('Building speeddict part %s for the file keys', part)
+                res.update(getattr(self, '_prepare_import_speeddict_%s' % part)(
+                    company, keys=keys))
+                continue
+            stamp = self._import_speeddict_stamp(model_names)
+            if part in entry and entry[part][0] == stamp:
+                logger.debug('Speeddict part %s taken from cache', part)
+            else:
+                logger.debug('Building speeddict part %s', part)
+                value = getattr(self, '_prepare_import_speeddict_%s' % part)(
+                    company)
+                entry[part] = (stamp, value)
+            res.update(entry[part][1])
+        speeddict_cache[key] = entry
+        return res
+
+    @api.model
+    def _prepare_import_speeddict(self, company, keys=None):
+        """Used in provided-specific modules. keys is an optional dict
+        with key = part of the speeddict and value = set of the keys of
+        that part present in the imported file (card tokens, lowercase
+        analytic codes, country codes, currency codes, vendor labels
+        normalized by newgen.payment.card.partner.label)"""
+        speeddict = self._get_import_speeddict_parts(company, keys=keys)
+        # The import adds the cards it creates in 'tokens': the cached
+        # dict must not be modified, in case the import is rolled back
+        speeddict['tokens'] = dict(speeddict['tokens'])
+        if not company.country_id.id:
+            raise UserError(_(
+                "Country is not set on company '%s'.") % company.display_name)
+        speeddict['my_country_id'] = company.country_id.id
         if not company.transfer_account_id:
             raise UserError(_(
                 "Missing 'Internal Bank Transfer Account' on company '%s'.")
@@ -624,30 +1402,6 @@ class NewgenPaymentCardTransaction(models.Model):
                 "The default partner (%s) should be a parent partner.")
                 % default_partner.display_name)
         speeddict['default_partner_id'] = default_partner.id
-        speeddict['partner_labels'] = {}
-        specific_partner_existing_transactions = npcto.search_read([
-            ('state', '=', 'done'),
-            ('transaction_type', '=', 'expense'),
-            ('vendor', '!=', False),
-            ('partner_id', '!=', False),
-            ('partner_id', '!=', speeddict['default_partner_id'])],
-            ['vendor', 'partner_id'], order='id')
-        # order by id to have the latest value for a particular label
-        for trans in specific_partner_existing_transactions:
-            label = unidecode(trans['vendor']).strip().upper()
-            speeddict['partner_labels'][label] = trans['partner_id'][0]
-        speeddict['partner_vat'] = {}
-        speeddict['partner_names'] = {}
-        partners = self.env['res.partner'].search_read(
-            [('parent_id', '=', False), ('id', '!=', company.partner_id.id)],
-            ['name', 'vat'])
-        for partner in partners:
-            partner_name = unidecode(partner['name'].strip().upper())
-            if len(partner_name) >= MEANINGFUL_PARTNER_NAME_MIN_SIZE:
-                speeddict['partner_names'][partner_name] = partner['id']
-            if partner['vat']:
-                # 'vat' field is already sanitized
-                speeddict['partner_vat'][partner['vat']] = partner['id']
         speeddict['default_vat_rate'] = 0
         if (
                 company.account_purchase_tax_id and
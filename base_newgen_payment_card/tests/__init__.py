@@ -1 +1,4 @@
 from . import test_mooncard_invoice
+from . import test_partner_name_index
+from . import test_receipt_image
+from . import test_receipt_download
@@ -2,9 +2,18 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+import base64
+import hashlib
+from unittest.mock import MagicMock, patch
+
+from odoo import fields
 from odoo.tests.common import TransactionCase
 from odoo.tools import float_compare
 
+SESSION_PATH = (
+    'odoo.addons.base_newgen_payment_card.tools.receipt_downloader'
+    '.requests.Session')
+
 
 class TestNewgenPaymentCard(TransactionCase):
 
@@ -40,6 +49,13 @@ class TestNewgenPaymentCard(TransactionCase):
             'currency_id': self.euro.id,
             })
         self.prec = self.company.currency_id.rounding
+        # the receipts of the demo transactions are not downloaded
+        patcher = patch(SESSION_PATH)
+        session_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session_get = session_class.return_value.get
+        self.session_get.return_value = MagicMock(
+            status_code=200, content=b'\x89PNG test receipt', headers={})
 
     def test_load_line(self):
         # Set company country to France
@@ -51,6 +67,331 @@ class TestNewgenPaymentCard(TransactionCase):
         self.assertEqual(load1.bank_move_id.date, load1.date)
 
     def test_expense_line(self):
+        self._check_expense_lines()
+
+    def test_expense_line_invoice_import(self):
+        self.env['ir.config_parameter'].sudo().set_param(
+            'newgen_payment_card.invoice_engine', 'import')
+        self._check_expense_lines()
+
+    def test_expense_lines_batch(self):
+        expenses = self.env['newgen.payment.card.transaction']
+        for expense_xmlid in ['expense1', 'expense2', 'expense3']:
+            expenses |= self.env.ref(
+                'base_newgen_payment_card.%s' % expense_xmlid)
+        expenses.write({'expense_account_id': self.expense_account.id})
+        expenses.process_line()
+        for expense in expenses:
+            self.assertEqual(expense.state, 'done')
+            self.assertEqual(expense.invoice_id.state, 'posted')
+            self.assertEqual(expense.invoice_id.payment_state, 'paid')
+            self.assertEqual(expense.invoice_id.ref, expense.name)
+            self.assertTrue(expense.reconcile_id)
+        self.assertEqual(len(expenses.invoice_id), 3)
+
+    def test_processing_run(self):
+        load1 = self.env.ref('base_newgen_payment_card.load1')
+        load1.with_context(newgen_profile=True).process_line()
+        run = self.env['newgen.payment.card.processing.run'].search([], limit=1)
+        self.assertEqual(run.transaction_count, 1)
+        self.assertIn('bank_move', run.stage_ids.mapped('name'))
+
+    def test_reconcile_stored_fields(self):
+        npcto = self.env['newgen.payment.card.transaction']
+        expense = self.env.ref('base_newgen_payment_card.expense1')
+        expense.write({'expense_account_id': self.expense_account.id})
+        expense.process_line()
+        reconcile = expense.reconcile_id
+        self.assertTrue(reconcile)
+        self.assertEqual(expense.invoice_payment_state, 'paid')
+        bank_line = expense.bank_move_id.line_ids.filtered(
+            lambda x: x.account_id == expense.bank_counterpart_account_id)
+        invoice_line = expense.invoice_id.line_ids.filtered(
+            lambda x: x.account_id == expense.bank_counterpart_account_id)
+        self.assertEqual(bank_line.full_reconcile_id, reconcile)
+        # the stored values are searched in the database
+        self.assertEqual(
+            npcto.search([('reconcile_id', '=', reconcile.id)]), expense)
+        bank_line.remove_move_reconcile()
+        self.assertFalse(expense.reconcile_id)
+        self.assertEqual(expense.invoice_payment_state, 'not_paid')
+        self.assertEqual(npcto.search([
+            ('id', '=', expense.id),
+            ('reconcile_id', '=', False),
+            ('invoice_payment_state', '=', 'not_paid'),
+            ]), expense)
+        (bank_line | invoice_line).reconcile()
+        self.assertTrue(expense.reconcile_id)
+        self.assertEqual(expense.invoice_payment_state, 'paid')
+        self.assertEqual(npcto.search([
+            ('id', '=', expense.id),
+            ('reconcile_id', '=', expense.reconcile_id.id),
+            ('invoice_payment_state', '=', 'paid'),
+            ]), expense)
+
+    def test_computes_once_per_key(self):
+        npcto = self.env['newgen.payment.card.transaction']
+        partners = self.env['res.partner'].create([
+            {'name': 'Compute Supplier 1'}, {'name': 'Compute Supplier 2'}])
+        vals_list = [{
+            'unique_import_id': 'test-computes-%d' % index,
+            'transaction_type': 'expense',
+            'date': fields.Datetime.now(),
+            'card_id': self.card1.id,
+            'company_id': self.company.id,
+            'partner_id': partners[index % 2].id,
+            'expense_account_id': self.expense_account.id,
+            'total_company_currency': -10.0 - index,
+            'total_currency': -10.0 - index,
+            'currency_id': self.euro.id,
+            } for index in range(6)]
+        distribution_model = type(
+            self.env['account.analytic.distribution.model'])
+        with patch.object(
+                distribution_model, '_get_distribution', autospec=True,
+                side_effect=distribution_model._get_distribution
+                ) as get_distribution, patch.object(
+                type(npcto), '_get_bank_counterpart_account_id', autospec=True,
+                side_effect=type(npcto)._get_bank_counterpart_account_id
+                ) as get_account:
+            transactions = npcto.create(vals_list)
+            transactions.flush_recordset()
+        self.assertEqual(get_distribution.call_count, 2)
+        self.assertEqual(get_account.call_count, 2)
+        for trans in transactions:
+            self.assertEqual(
+                trans.bank_counterpart_account_id,
+                trans.partner_id.property_account_payable_id)
+
+    def test_processing_context(self):
+        npcto = self.env['newgen.payment.card.transaction']
+        expenses = npcto
+        for expense_xmlid in ['expense1', 'expense2', 'expense3']:
+            expenses |= self.env.ref(
+                'base_newgen_payment_card.%s' % expense_xmlid)
+        expenses.write({'expense_account_id': self.expense_account.id})
+        prepare = type(npcto)._prepare_processing_context
+        with patch.object(
+                type(npcto), '_prepare_processing_context', autospec=True,
+                side_effect=prepare) as prepare_mock:
+            # outside process_line(), it is built on each call
+            expenses[0]._get_processing_context()
+            expenses[0]._get_processing_context()
+            self.assertEqual(prepare_mock.call_count, 2)
+            prepare_mock.reset_mock()
+            # once per company for all the processed transactions
+            expenses.process_line()
+            self.assertEqual(prepare_mock.call_count, 1)
+        context = npcto._prepare_processing_context(self.company)
+        journal = context['purchase_journal']
+        self.assertTrue(journal)
+        for expense in expenses:
+            self.assertEqual(expense.state, 'done')
+            self.assertEqual(expense.invoice_id.journal_id, journal)
+        self.assertEqual(
+            context['transaction_type_labels']['expense'], 'Expense')
+
+    def test_partner_labels(self):
+        label_model = self.env['newgen.payment.card.partner.label']
+        npcto = self.env['newgen.payment.card.transaction']
+        partner = self.env['res.partner'].create({'name': 'SNCF Voyageurs'})
+        expense = self.env.ref('base_newgen_payment_card.expense3')
+        expense.write({
+            'expense_account_id': self.expense_account.id,
+            'partner_id': partner.id,
+            })
+        partner2 = self.env['res.partner'].create({'name': 'SNCF Connect'})
+        expense2 = expense.copy({
+            'unique_import_id': 'test-partner-labels-sncf',
+            'vendor': ' sncf ',
+            'partner_id': partner2.id,
+            })
+        # only done transactions give the partner of their label
+        self.assertFalse(label_model.search([('label', '=', 'SNCF')]))
+        expense.process_line()
+        label = label_model.search([('label', '=', 'SNCF')])
+        self.assertEqual(label.partner_id, partner)
+        self.assertEqual(label.transaction_id, expense)
+        speeddict = npcto._prepare_import_speeddict_partner_labels(
+            self.company, keys={'partner_labels': {'SNCF', 'EASYJET'}})
+        self.assertEqual(speeddict['partner_labels'], {'SNCF': partner.id})
+        # a more recent transaction with the same label takes it over
+        expense2.process_line()
+        self.assertEqual(expense2.vendor_label, 'SNCF')
+        self.assertEqual(label.partner_id, partner2)
+        self.assertEqual(label.transaction_id, expense2)
+        # writing the same partner doesn't touch the labels
+        with patch.object(
+                type(label_model), '_update_from_transactions') as update:
+            expense2.write({'partner_id': partner2.id})
+            update.assert_not_called()
+        # when the label is removed from the latest transaction,
+        # it falls back to the previous one
+        expense2.write({'partner_id': npcto._default_partner().id})
+        label = label_model.search([('label', '=', 'SNCF')])
+        self.assertEqual(label.partner_id, partner)
+        self.assertEqual(label.transaction_id, expense)
+        expense.write({'partner_id': npcto._default_partner().id})
+        self.assertFalse(label.exists())
+
+    def test_speeddict_cache_partners(self):
+        npcto = self.env['newgen.payment.card.transaction']
+        partner = self.env['res.partner'].create({'name': 'Speeddict One'})
+        prepare = type(npcto)._prepare_import_speeddict_partners
+        with patch.object(
+                type(npcto), '_prepare_import_speeddict_partners',
+                autospec=True, side_effect=prepare) as build:
+            speeddict = npcto.with_context(
+                newgen_speeddict_no_cache=True)._get_import_speeddict_parts(
+                    self.company)
+            self.assertEqual(build.call_count, 1)
+            self.assertEqual(
+                speeddict['partner_names']['SPEEDDICT ONE'], partner.id)
+            # a contact is not in the speeddict
+            self.env['res.partner'].create({
+                'name': 'Speeddict Contact', 'parent_id': partner.id})
+            npcto._get_import_speeddict_parts(self.company)
+            self.assertEqual(build.call_count, 1)
+            partner.write({'name': 'Speeddict Two'})
+            # the write date is the start of the transaction: set it as
+            # if the partner had been written by a later transaction
+            partner.flush_recordset()
+            self.env.cr.execute(
+                "UPDATE res_partner SET write_date=write_date + interval '1 second' "
+                "WHERE id=%s", (partner.id,))
+            partner.invalidate_recordset(['write_date'])
+            speeddict = npcto._get_import_speeddict_parts(self.company)
+            self.assertEqual(build.call_count, 2)
+            self.assertEqual(
+                speeddict['partner_names']['SPEEDDICT TWO'], partner.id)
+            self.assertNotIn('SPEEDDICT ONE', speeddict['partner_names'])
+            partner2 = self.env['res.partner'].create({'name': 'Speeddict 3'})
+            speeddict = npcto._get_import_speeddict_parts(self.company)
+            self.assertEqual(build.call_count, 3)
+            self.assertEqual(
+                speeddict['partner_names']['SPEEDDICT 3'], partner2.id)
+            # same number of partners, same write dates
+            partner2.unlink()
+            partner3 = self.env['res.partner'].create({'name': 'Speeddict 4'})
+            partner3.flush_recordset()
+            self.env.cr.execute(
+                "UPDATE res_partner SET write_date=%s WHERE id=%s",
+                (partner.write_date, partner3.id))
+            speeddict = npcto._get_import_speeddict_parts(self.company)
+            self.assertEqual(build.call_count, 4)
+            self.assertNotIn('SPEEDDICT 3', speeddict['partner_names'])
+            self.assertEqual(
+                speeddict['partner_names']['SPEEDDICT 4'], partner3.id)
+            partner3.unlink()
+            speeddict = npcto._get_import_speeddict_parts(self.company)
+            self.assertEqual(build.call_count, 5)
+            self.assertNotIn('SPEEDDICT 4', speeddict['partner_names'])
+
+    def test_claim_transactions(self):
+        npcto = self.env['newgen.payment.card.transaction']
+        load1 = self.env.ref('base_newgen_payment_card.load1')
+        expense1 = self.env.ref('base_newgen_payment_card.expense1')
+        claimed = npcto._claim_transactions_to_process(100)
+        self.assertIn(load1, claimed)
+        # no expense account
+        self.assertNotIn(expense1, claimed)
+        self.assertEqual(len(npcto._claim_transactions_to_process(1)), 1)
+
+    def test_claim_skip_locked(self):
+        npcto = self.env['newgen.payment.card.transaction']
+        load1 = self.env.ref('base_newgen_payment_card.load1')
+        # load1 is demo data, so it is visible from another transaction
+        with self.registry.cursor() as other_cr:
+            other_cr.execute(
+                "SELECT id FROM newgen_payment_card_transaction "
+                "WHERE id=%s FOR UPDATE NOWAIT", (load1.id, ))
+            self.assertNotIn(load1, npcto._claim_transactions_to_process(100))
+            other_cr.rollback()
+
+    def test_process_claimed_transactions_fallback(self):
+        card_no_journal = self.env['newgen.payment.card'].create({
+            'name': 'Test card without journal',
+            'company_id': self.company.id,
+            'journal_id': False,
+            })
+        load1 = self.env.ref('base_newgen_payment_card.load1')
+        load2 = load1.copy({
+            'card_id': card_no_journal.id,
+            'unique_import_id': 'test-load-without-journal',
+            })
+        (load1 | load2)._process_claimed_transactions()
+        # the batch failed: the transactions were processed one by one
+        self.assertEqual(load1.state, 'done')
+        self.assertFalse(load1.processing_error)
+        self.assertEqual(load2.state, 'draft')
+        self.assertIn('Bank Journal not configured', load2.processing_error)
+        # skipped by the scheduled action until it is modified
+        npcto = self.env['newgen.payment.card.transaction']
+        self.assertNotIn(load2, npcto._claim_transactions_to_process(100))
+        card_no_journal.journal_id = self.card_bank_journal.id
+        load2.write({'description': 'Load'})
+        self.assertFalse(load2.processing_error)
+        self.assertIn(load2, npcto._claim_transactions_to_process(100))
+
+    def test_cron_process_transactions(self):
+        self.env['ir.config_parameter'].sudo().set_param(
+            'newgen_payment_card.processing_batch_size', 1000)
+        load1 = self.env.ref('base_newgen_payment_card.load1')
+        self.env['newgen.payment.card.transaction']._cron_process_transactions()
+        self.assertEqual(load1.state, 'done')
+
+    def test_cached_receipt_attachment(self):
+        content = b'Receipt of the test transaction'
+        url = 'https://receipts.example.com/test-cached-receipt.png'
+        receipt = self.env['newgen.payment.card.receipt'].create({
+            'url': url,
+            'file_extension': '.png',
+            'checksum': hashlib.sha1(content).hexdigest(),
+            'date_checked': fields.Datetime.now(),
+            'image': base64.b64encode(content),
+            'size': len(content),
+            'normalized_size': len(content),
+            })
+        expense = self.env.ref('base_newgen_payment_card.expense1')
+        expense.write({
+            'expense_account_id': self.expense_account.id,
+            'image_url': url,
+            })
+        expense.process_line()
+        self.assertFalse(self.session_get.called)
+        attachment = self.env['ir.attachment'].search([
+            ('res_model', '=', 'account.move'),
+            ('res_id', '=', expense.invoice_id.id),
+            ('name', '=like', 'Receipt-%'),
+            ])
+        self.assertEqual(len(attachment), 1)
+        self.assertEqual(attachment.raw, content)
+        cache_attachment = self.env['ir.attachment'].search([
+            ('res_model', '=', 'newgen.payment.card.receipt'),
+            ('res_field', '=', 'image'),
+            ('res_id', '=', receipt.id),
+            ])
+        self.assertEqual(attachment.checksum, cache_attachment.checksum)
+        # the file of the cache is given to the attachment without reading it
+        npcto = self.env['newgen.payment.card.transaction']
+        attachment_class = type(self.env['ir.attachment'])
+        with patch.object(
+                attachment_class, '_file_read', autospec=True,
+                side_effect=attachment_class._file_read) as file_read, \
+                patch.object(
+                    attachment_class, '_file_write', autospec=True,
+                    side_effect=attachment_class._file_write) as file_write:
+            attachment2 = npcto._create_invoice_attachments(
+                npcto._prepare_invoice_attachment_vals(
+                    {'Receipt-copy.png': cache_attachment}, expense.invoice_id))
+            self.assertEqual(attachment2.store_fname, cache_attachment.store_fname)
+            self.assertEqual(attachment2.file_size, len(content))
+            self.assertFalse(file_read.called)
+            self.assertFalse(file_write.called)
+        self.assertEqual(attachment2.raw, content)
+        self.assertEqual(attachment2.res_id, expense.invoice_id.id)
+
+    def _check_expense_lines(self):
         for expense_xmlid in ['expense1', 'expense2', 'expense3']:
             expense = self.env.ref(
                 'base_newgen_payment_card.%s' % expense_xmlid)
@@ -0,0 +1,70 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase
+
+from ..tools import PartnerNameIndex
+
+
+class TestPartnerNameIndex(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.names = [
+            ('SNCF', 1),
+            ('EASYJET', 2),
+            ('PIZZERIA OPENWEB', 3),
+            ('OPENWEB', 4),
+            ('AIR FRANCE KLM', 5),
+            ]
+        self.index = PartnerNameIndex(self.names)
+
+    def _brute_force(self, vendor, rule):
+        for name, partner_id in self.names:
+            if rule == 'contain' and (name in vendor or vendor in name):
+                return partner_id
+            elif rule == 'equal' and name == vendor:
+                return partner_id
+        return False
+
+    def test_match(self):
+        vendors = [
+            'SNCF', 'SNCF INTERNET', 'OPENWEB', 'PIZZERIA OPENWEB LYON',
+            'AIR FRANCE', 'FRANCE', 'EASYJE', 'TOTAL', 'WEB']
+        for vendor in vendors:
+            for rule in ('contain', 'equal'):
+                self.assertEqual(
+                    self.index.match(vendor, rule),
+                    self._brute_force(vendor, rule),
+                    "vendor=%s rule=%s" % (vendor, rule))
+
+    def test_no_match_across_names(self):
+        # 'JETPIZZ' is across EASYJET and PIZZERIA in the blob of names
+        self.assertFalse(self.index.match('JETPIZZ', 'contain'))
+        self.assertFalse(self.index.match('JET', 'other_rule'))
+
+    def test_large_index(self):
+        # 'vendor in name' only checks the names of the rarest trigram
+        # of the vendor label, not all the names
+        names = [('PARTNER %06d' % i, i + 1) for i in range(20000)]
+        names.append(('SUPPLIER ZZ', 20001))
+        index = PartnerNameIndex(names)
+        checks = {
+            'PLIER Z': (20001, 1),
+            '012345': (12346, 50),
+            'NER 01999': (19991, 50),
+            'ARTNER': (1, 1),
+            'PARTNER 9': (False, 0),
+            }
+        for vendor, (partner_id, max_checks) in checks.items():
+            with patch.object(
+                    PartnerNameIndex, '_name_contains', autospec=True,
+                    side_effect=PartnerNameIndex._name_contains) as check:
+                self.assertEqual(index.match_contain(vendor), partner_id)
+            self.assertLessEqual(check.call_count, max_checks, vendor)
+        # shorter than a trigram
+        self.assertEqual(index.match_contain('9'), 10)
+        self.assertFalse(index.match_contain('R0'))
@@ -0,0 +1,196 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import base64
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+from ..tools import ReceiptDownloader
+
+SESSION_PATH = (
+    'odoo.addons.base_newgen_payment_card.tools.receipt_downloader'
+    '.requests.Session')
+
+
+def _response(status_code, content=b'', headers=None):
+    return MagicMock(
+        status_code=status_code, content=content, headers=headers or {})
+
+
+class TestReceiptDownloader(TransactionCase):
+
+    def test_max_per_host(self):
+        lock = threading.Lock()
+        running = {}
+        max_running = {}
+
+        def get(url, timeout=None, headers=None):
+            host = url.split('/')[2]
+            with lock:
+                running[host] = running.get(host, 0) + 1
+                max_running[host] = max(max_running.get(host, 0), running[host])
+            time.sleep(0.02)
+            with lock:
+                running[host] -= 1
+            return _response(200, url.encode())
+
+        urls = ['https://a.example.com/%d.png' % i for i in range(12)]
+        urls += ['https://b.example.com/%d.png' % i for i in range(4)]
+        with patch(SESSION_PATH) as session_class:
+            session_class.return_value.get.side_effect = get
+            with ReceiptDownloader(max_workers=8, max_per_host=2) as downloader:
+                res = downloader.fetch_all(urls)
+        self.assertEqual(len(res), 16)
+        self.assertEqual(res[urls[3]].content, urls[3].encode())
+        self.assertEqual(max_running['a.example.com'], 2)
+        self.assertLessEqual(max_running['b.example.com'], 2)
+
+    def test_connection_error(self):
+        with patch(SESSION_PATH) as session_class:
+            session_class.return_value.get.side_effect = ConnectionError('down')
+            with ReceiptDownloader() as downloader:
+                download = downloader.fetch('https://a.example.com/1.png')
+        self.assertFalse(download.status_code)
+        self.assertIsInstance(download.error, ConnectionError)
+
+    def test_retry(self):
+        # the retries are done by urllib3 under requests: they are tested
+        # against a local server that fails the first requests
+        requests_count = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests_count.append(self.path)
+                if len(requests_count) < 3:
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', '7')
+                self.end_headers()
+                self.wfile.write(b'receipt')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%d/receipt.png' % server.server_port
+            with ReceiptDownloader(retries=2, timeout=5) as downloader:
+                download = downloader.fetch(url)
+            self.assertEqual(download.status_code, 200)
+            self.assertEqual(download.content, b'receipt')
+            self.assertEqual(len(requests_count), 3)
+            # no retry left: the last answer is returned
+            del requests_count[:]
+            with ReceiptDownloader(retries=1, timeout=5) as downloader:
+                download = downloader.fetch(url)
+            self.assertEqual(download.status_code, 503)
+            self.assertEqual(len(requests_count), 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestReceiptCache(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.receipt_model = self.env['newgen.payment.card.receipt']
+        self.url1 = 'https://receipts.example.com/1.png'
+        self.url2 = 'https://receipts.example.com/2.png'
+        self.content = b'\x89PNG receipt'
+        self.answers = {}
+        self.sent_headers = {}
+
+        def get(url, timeout=None, headers=None):
+            self.sent_headers[url] = headers
+            return self.answers[url]
+
+        patcher = patch(SESSION_PATH)
+        session_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session_get = session_class.return_value.get
+        self.session_get.side_effect = get
+
+    def _receipt(self, url):
+        return self.receipt_model.search([('url', '=', url)])
+
+    def test_revalidation(self):
+        self.answers[self.url1] = _response(
+            200, self.content, {'ETag': '"v1"', 'Last-Modified': 'Mon'})
+        res = self.receipt_model._fetch([self.url1])
+        self.assertEqual(res[self.url1].content, self.content)
+        receipt = self._receipt(self.url1)
+        self.assertEqual(receipt.etag, '"v1"')
+        self.assertEqual(
+            receipt.checksum, hashlib.sha1(self.content).hexdigest())
+        self.assertEqual(receipt.size, len(self.content))
+        # recent enough: taken from the cache
+        res = self.receipt_model._fetch([self.url1])
+        self.assertEqual(res[self.url1].content, self.content)
+        self.assertEqual(self.session_get.call_count, 1)
+        # older: revalidated with a conditional request
+        receipt.write({
+            'date_checked': fields.Datetime.now() - timedelta(days=2)})
+        self.answers[self.url1] = _response(304)
+        res = self.receipt_model._fetch([self.url1])
+        self.assertEqual(self.session_get.call_count, 2)
+        self.assertEqual(self.sent_headers[self.url1], {
+            'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon'})
+        self.assertEqual(res[self.url1].content, self.content)
+        self.assertGreater(
+            receipt.date_checked, fields.Datetime.now() - timedelta(hours=1))
+        # modified: downloaded and stored again
+        receipt.write({
+            'date_checked': fields.Datetime.now() - timedelta(days=2)})
+        self.answers[self.url1] = _response(200, b'new receipt', {'ETag': '"v2"'})
+        res = self.receipt_model._fetch([self.url1])
+        self.assertEqual(res[self.url1].content, b'new receipt')
+        self.assertEqual(receipt.etag, '"v2"')
+        self.assertEqual(base64.b64decode(receipt.image), b'new receipt')
+        self.assertEqual(len(self._receipt(self.url1)), 1)
+
+    def test_same_content(self):
+        self.answers[self.url1] = _response(200, self.content)
+        self.answers[self.url2] = _response(200, self.content)
+        normalize = type(self.receipt_model)._normalize_image
+        with patch.object(
+                type(self.receipt_model), '_normalize_image', autospec=True,
+                side_effect=normalize) as normalize_mock:
+            self.receipt_model._fetch([self.url1])
+            res = self.receipt_model._fetch([self.url2])
+        # the receipt of url2 is the one of url1: not normalized again
+        self.assertEqual(normalize_mock.call_count, 1)
+        self.assertEqual(res[self.url2].content, self.content)
+        receipt1 = self._receipt(self.url1)
+        receipt2 = self._receipt(self.url2)
+        self.assertEqual(receipt1.checksum, receipt2.checksum)
+        self.assertEqual(receipt2.normalized_size, receipt1.normalized_size)
+
+    def test_failed_download_not_cached(self):
+        self.answers[self.url1] = _response(404)
+        res = self.receipt_model._fetch([self.url1])
+        self.assertEqual(res[self.url1].status_code, 404)
+        self.assertFalse(self._receipt(self.url1))
+
+    def test_autovacuum(self):
+        self.answers[self.url1] = _response(200, self.content)
+        self.answers[self.url2] = _response(200, b'other receipt')
+        self.receipt_model._fetch([self.url1, self.url2])
+        self._receipt(self.url1).write({
+            'date_checked': fields.Datetime.now() - timedelta(days=365)})
+        self.receipt_model._gc_receipt_cache()
+        self.assertFalse(self._receipt(self.url1))
+        self.assertTrue(self._receipt(self.url2))
@@ -0,0 +1,43 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import io
+
+from PIL import Image
+
+from odoo.tests.common import TransactionCase
+
+from ..tools import normalize_jpeg
+from ..tools.receipt_image import EXIF_ORIENTATION_TAG
+
+
+class TestReceiptImage(TransactionCase):
+
+    def _jpeg(self, size, orientation=None):
+        image = Image.new('RGB', size, color=(200, 30, 30))
+        output = io.BytesIO()
+        kwargs = {}
+        if orientation:
+            exif = Image.Exif()
+            exif[EXIF_ORIENTATION_TAG] = orientation
+            kwargs['exif'] = exif.tobytes()
+        image.save(output, format='JPEG', **kwargs)
+        return output.getvalue()
+
+    def test_normal_orientation_kept_as_is(self):
+        image_binary = self._jpeg((300, 200))
+        self.assertIs(normalize_jpeg(image_binary), image_binary)
+        image_binary = self._jpeg((300, 200), orientation=1)
+        self.assertIs(normalize_jpeg(image_binary, max_dimension=400), image_binary)
+
+    def test_rotation(self):
+        image_binary = self._jpeg((300, 200), orientation=6)
+        image = Image.open(io.BytesIO(normalize_jpeg(image_binary)))
+        self.assertEqual(image.size, (200, 300))
+
+    def test_max_dimension(self):
+        image_binary = self._jpeg((1600, 1200), orientation=6)
+        image = Image.open(io.BytesIO(normalize_jpeg(
+            image_binary, max_dimension=400, quality=70)))
+        self.assertEqual(image.size, (300, 400))
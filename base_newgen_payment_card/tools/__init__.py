@@ -0,0 +1,4 @@
+from .partner_name_index import PartnerNameIndex
+from .receipt_downloader import ReceiptDownload, ReceiptDownloader
+from .processing_profiler import ProcessingProfiler
+from .receipt_image import normalize_jpeg
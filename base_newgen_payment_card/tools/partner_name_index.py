@@ -0,0 +1,132 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from array import array
+from bisect import bisect_right
+
+# Partner names never contain this character, so a vendor label
+# can't match across 2 names of the blob
+NAME_SEPARATOR = '\x00'
+# Length of the substrings of the partner names which are indexed
+NGRAM_SIZE = 3
+
+
+class PartnerNameIndex(object):
+    """Index on partner names used to match the vendor label of a payment
+    card transaction with a partner.
+
+    It is built from the (name, partner_id) pairs in the order in which
+    they should be tried and gives the same result as trying them one by
+    one and keeping the first match, with the rules:
+    - 'equal': the vendor label is the partner name,
+    - 'contain': the partner name is in the vendor label or the vendor
+      label is in the partner name.
+
+    'name in vendor' is answered by looking up in a dict all the
+    substrings of the vendor label that have the length of a partner name,
+    so it only depends on the length of the vendor label.
+    'vendor in name' is answered by an index of the trigrams of the
+    partner names: a name that contains the vendor label contains all its
+    trigrams, so only the names of the rarest trigram of the vendor label
+    are checked, in order. Vendor labels shorter than a trigram are
+    searched in a blob of all the partner names joined in order.
+    """
+
+    def __init__(self, names):
+        # name -> (rank, partner_id)
+        self.name2rank = {}
+        self.rank2partner = []
+        self.names = []
+        lengths = set()
+        # key = trigram, value = ranks of the names which contain it
+        ngram_ranks = {}
+        for name, partner_id in names:
+            if not name or NAME_SEPARATOR in name or name in self.name2rank:
+                continue
+            rank = len(self.rank2partner)
+            self.name2rank[name] = (rank, partner_id)
+            self.rank2partner.append(partner_id)
+            self.names.append(name)
+            lengths.add(len(name))
+            for ngram in {
+                    name[start:start + NGRAM_SIZE]
+                    for start in range(len(name) - NGRAM_SIZE + 1)}:
+                ranks = ngram_ranks.get(ngram)
+                if ranks is None:
+                    ngram_ranks[ngram] = array('i', [rank])
+                else:
+                    ranks.append(rank)
+        self.lengths = sorted(lengths)
+        self.ngram_ranks = ngram_ranks
+        self.blob = NAME_SEPARATOR.join(self.names)
+        starts = array('i')
+        pos = 0
+        for name in self.names:
+            starts.append(pos)
+            pos += len(name) + len(NAME_SEPARATOR)
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.rank2partner)
+
+    def _name_contains(self, rank, vendor):
+        return vendor in self.names[rank]
+
+    def _first_name_containing(self, vendor, max_rank=None):
+        """Returns the rank of the first partner name which contains
+        the vendor label, if it is lower than max_rank"""
+        if len(vendor) < NGRAM_SIZE:
+            pos = self.blob.find(vendor)
+            if pos < 0:
+                return None
+            rank = bisect_right(self.starts, pos) - 1
+            if max_rank is not None and rank >= max_rank:
+                return None
+            return rank
+        candidates = None
+        for start in range(len(vendor) - NGRAM_SIZE + 1):
+            ranks = self.ngram_ranks.get(vendor[start:start + NGRAM_SIZE])
+            if ranks is None:
+                return None
+            if candidates is None or len(ranks) < len(candidates):
+                candidates = ranks
+        for rank in candidates:
+            if max_rank is not None and rank >= max_rank:
+                return None
+            if self._name_contains(rank, vendor):
+                return rank
+        return None
+
+    def match_equal(self, vendor):
+        entry = self.name2rank.get(vendor)
+        return entry and entry[1] or False
+
+    def match_contain(self, vendor):
+        if not vendor or NAME_SEPARATOR in vendor:
+            return False
+        best_rank = None
+        # partner name in vendor
+        name2rank = self.name2rank
+        vendor_len = len(vendor)
+        for length in self.lengths:
+            if length > vendor_len:
+                break
+            for start in range(vendor_len - length + 1):
+                entry = name2rank.get(vendor[start:start + length])
+                if entry and (best_rank is None or entry[0] < best_rank):
+                    best_rank = entry[0]
+        # vendor in partner name
+        rank = self._first_name_containing(vendor, max_rank=best_rank)
+        if rank is not None:
+            best_rank = rank
+        if best_rank is None:
+            return False
+        return self.rank2partner[best_rank]
+
+    def match(self, vendor, partner_match_rule='contain'):
+        if partner_match_rule == 'contain':
+            return self.match_contain(vendor)
+        elif partner_match_rule == 'equal':
+            return self.match_equal(vendor)
+        return False
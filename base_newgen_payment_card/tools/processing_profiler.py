@@ -0,0 +1,52 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import time
+from contextlib import contextmanager
+
+
+class ProcessingProfiler(object):
+    """Aggregate, per stage of the processing of transactions, the wall time,
+    the number of SQL queries, the number of transactions and the number
+    of bytes transferred"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # key = stage, value = dict
+        self.stages = {}
+
+    def _get_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {
+                'count': 0, 'duration': 0.0, 'query_count': 0, 'size': 0}
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name, cr, count=1):
+        """Record the time and the queries (of the cursor cr) spent
+        in the block for count transactions"""
+        start = time.perf_counter()
+        query_start = getattr(cr, 'sql_log_count', 0)
+        try:
+            yield
+        finally:
+            stage = self._get_stage(name)
+            stage['count'] += count
+            stage['duration'] += time.perf_counter() - start
+            stage['query_count'] += getattr(cr, 'sql_log_count', 0) - query_start
+
+    def add_size(self, name, size):
+        self._get_stage(name)['size'] += size
+
+    @property
+    def duration(self):
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        """Returns a one-line summary of the stages, for the logs"""
+        return ', '.join(
+            '%s: %.2fs/%d queries/%d trans%s' % (
+                name, stage['duration'], stage['query_count'], stage['count'],
+                stage['size'] and '/%d bytes' % stage['size'] or '')
+            for name, stage in self.stages.items())
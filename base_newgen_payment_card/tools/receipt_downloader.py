@@ -0,0 +1,84 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# error is the exception raised by requests, if any
+ReceiptDownload = namedtuple(
+    'ReceiptDownload', ['url', 'status_code', 'content', 'headers', 'error'])
+
+
+class ReceiptDownloader(object):
+    """Download receipts with a pool of keep-alive HTTP connections,
+    in several threads, with a maximum number of simultaneous requests
+    per host and retries on connection errors and 5xx/429 answers."""
+
+    def __init__(self, max_workers=8, max_per_host=4, retries=2, timeout=30):
+        self.max_workers = max(max_workers, 1)
+        self.max_per_host = max(max_per_host, 1)
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries, connect=retries, read=retries, backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=self.max_workers, pool_maxsize=self.max_per_host,
+            max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(
+                    self.max_per_host)
+            return self._host_semaphores[host]
+
+    def fetch(self, url, headers=None):
+        with self._host_semaphore(url):
+            try:
+                res = self.session.get(url, timeout=self.timeout, headers=headers)
+            except Exception as e:
+                logger.warning('Failed to download %s: %s', url, e)
+                return ReceiptDownload(url, False, False, {}, e)
+        logger.debug(
+            'Downloaded %s: HTTP %s, %d bytes', url, res.status_code,
+            len(res.content))
+        return ReceiptDownload(url, res.status_code, res.content, res.headers, None)
+
+    def fetch_all(self, urls, headers=None):
+        """Download the URLs in parallel. headers is an optional dict
+        with key = url and value = dict of HTTP headers for that URL.
+        Returns a dict with key = url and value = ReceiptDownload"""
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        headers = headers or {}
+        workers = min(self.max_workers, len(urls))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda url: self.fetch(url, headers.get(url)), urls)
+            return {result.url: result for result in results}
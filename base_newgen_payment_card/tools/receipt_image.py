@@ -0,0 +1,46 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    logger.debug('Cannot import Pillow version >= 6.0.0')
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def normalize_jpeg(image_binary, max_dimension=0, quality=0):
+    """Returns the JPEG image rotated according to its EXIF orientation
+    and reduced to max_dimension pixels (if max_dimension is set).
+
+    The EXIF orientation and the size are read from the headers: when
+    the image doesn't need to be rotated nor reduced, it is returned as-is
+    without being decoded. When it has to be reduced, it is decoded
+    in draft mode, i.e. directly at a lower resolution by the JPEG
+    decoder. quality is the JPEG quality of the new image (0 for the
+    default quality of Pillow)."""
+    # BytesIO doesn't copy the bytes until they are modified
+    image = Image.open(io.BytesIO(image_binary))
+    orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    reduce = bool(max_dimension) and max(image.size) > max_dimension
+    if orientation == 1 and not reduce:
+        logger.debug('JPEG image has a normal orientation: kept as-is')
+        return image_binary
+    if reduce:
+        # the decoder picks the smallest scale >= the requested size
+        image.draft(image.mode, (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    if reduce:
+        image.thumbnail((max_dimension, max_dimension))
+    save_kwargs = {}
+    if quality:
+        save_kwargs['quality'] = quality
+    output = io.BytesIO()
+    image.save(output, format='JPEG', **save_kwargs)
+    return output.getvalue()
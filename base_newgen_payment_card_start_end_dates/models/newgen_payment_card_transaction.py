@@ -40,3 +40,13 @@ class NewgenPaymentCardTransaction(models.Model):
                 'date_end': self.end_date,
                 })
         return parsed_inv
+
+    @api.model
+    def _prepare_invoice_line_vals(self, parsed_line, import_config, taxes):
+        vals = super()._prepare_invoice_line_vals(parsed_line, import_config, taxes)
+        if parsed_line.get('date_start') and parsed_line.get('date_end'):
+            vals.update({
+                'start_date': parsed_line['date_start'],
+                'end_date': parsed_line['date_end'],
+                })
+        return vals
@@ -2,49 +2,54 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from odoo import models
-from odoo.tools import float_compare
+from odoo import api, models
 
 
 class NewgenPaymentCardTransaction(models.Model):
     _inherit = 'newgen.payment.card.transaction'
 
+    @api.model
+    def _prepare_processing_context(self, company):
+        res = super()._prepare_processing_context(company)
+        res['asset_vat_taxes'] = {}
+        if company.country_id.code in ("FR", "GP", "MQ", "GF", "RE", "YT"):
+            res['asset_vat_taxes'] = self._prepare_asset_vat_taxes(
+                company, res['purchase_taxes'])
+        return res
+
+    @api.model
+    def _prepare_asset_vat_taxes(self, company, possible_taxes):
+        """Returns a dict with key = rate (rounded to 2 digits)
+        and value = tax "TVA déd./immobilisation (achat)" """
+        accounts = self.env['account.account'].search([
+            ('company_id', '=', company.id),
+            ('code', '=ilike', '44562%'),
+            ])
+        if not accounts:
+            return {}
+        lines = self.env['account.tax.repartition.line'].search([
+            ('repartition_type', '=', 'tax'),
+            ('company_id', '=', company.id),
+            ('invoice_tax_id', 'in', possible_taxes.ids),
+            ('refund_tax_id', '=', False),
+            ('account_id', 'in', accounts.ids),
+            ('factor_percent', '>', 99.99),
+            ('factor_percent', '<', 100.01),
+            ])
+        res = {}
+        for line in lines:
+            res.setdefault(round(line.tax_id.amount, 2), line.tax_id)
+        return res
+
     def _prepare_regular_taxes(self):
         # Set tax "TVA déd./immobilisation (achat)" on expenses with an asset account
         self.ensure_one()
         taxes = super()._prepare_regular_taxes()
         if (
-                self.company_id.country_id.code in ("FR", "GP", "MQ", "GF", "RE", "YT")
-                and self.expense_account_id
+                self.expense_account_id
                 and self.expense_account_id.code.startswith(('20', '21'))):
-            possible_taxes = self.env['account.tax'].search([
-                ('company_id', '=', self.company_id.id),
-                ('type_tax_use', '=', 'purchase'),
-                ('unece_type_code', '=', 'VAT'),
-                ('amount_type', '=', 'percent'),
-                ('amount', '>', 0),
-                ])
-            accounts = self.env['account.account'].search([
-                ('company_id', '=', self.company_id.id),
-                ('code', '=ilike', '44562%'),
-                ])
-            if not accounts:
-                return taxes
-            lines = self.env['account.tax.repartition.line'].search([
-                ('repartition_type', '=', 'tax'),
-                ('company_id', '=', self.company_id.id),
-                ('invoice_tax_id', 'in', possible_taxes.ids),
-                ('refund_tax_id', '=', False),
-                ('account_id', 'in', accounts.ids),
-                ('factor_percent', '>', 99.99),
-                ('factor_percent', '<', 100.01),
-                ])
-            if not lines:
-                return taxes
-            if lines:
-                for line in lines:
-                    if not float_compare(
-                            line.tax_id.amount, self.vat_rate, precision_digits=2):
-                        taxes = [{"id": line.tax_id.id}]
-                        break
+            asset_vat_taxes = self._get_processing_context()['asset_vat_taxes']
+            tax = asset_vat_taxes.get(round(self.vat_rate, 2))
+            if tax:
+                taxes = [{"id": tax.id}]
         return taxes
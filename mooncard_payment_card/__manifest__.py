@@ -17,6 +17,8 @@
         'security/ir.model.access.csv',
         'data/sequence.xml',
         'data/ir_config_parameter.xml',
+        'data/ir_cron.xml',
+        'views/mooncard_import_job.xml',
         'wizard/mooncard_csv_import_view.xml',
         'views/mooncard_mileage.xml',
     ],
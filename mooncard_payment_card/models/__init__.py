@@ -1 +1,2 @@
 from . import mooncard_mileage
+from . import mooncard_import_job
@@ -0,0 +1,209 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import json
+import logging
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from psycopg2 import errors as pg_errors
+
+logger = logging.getLogger(__name__)
+
+
+class MooncardImportJob(models.Model):
+    _name = 'mooncard.import.job'
+    _description = 'Mooncard Import Job'
+    _order = 'id desc'
+    _check_company_auto = True
+
+    name = fields.Char(required=True, readonly=True)
+    company_id = fields.Many2one(
+        'res.company', required=True, readonly=True,
+        default=lambda self: self.env.company)
+    user_id = fields.Many2one(
+        'res.users', string='User', required=True, readonly=True,
+        default=lambda self: self.env.user,
+        help="The import is run with the access rights of this user.")
+    filename = fields.Char(readonly=True)
+    file_format = fields.Selection([
+        ('transaction', 'Transactions'),
+        ('mileage', 'Mileage'),
+        ], required=True, readonly=True)
+    chunk_ids = fields.One2many(
+        'mooncard.import.job.chunk', 'job_id', string='Chunks', readonly=True)
+    line_count = fields.Integer(
+        compute='_compute_progress', string='Number of Lines')
+    chunk_count = fields.Integer(compute='_compute_progress')
+    chunk_done_count = fields.Integer(compute='_compute_progress')
+    chunk_failed_count = fields.Integer(compute='_compute_progress')
+    progress = fields.Float(compute='_compute_progress', string='Progress (%)')
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ], compute='_compute_progress')
+
+    # No stored compute on the job: the chunks are processed in their own
+    # transactions, which must not all write on the row of the job
+    @api.depends('chunk_ids.state', 'chunk_ids.line_count')
+    def _compute_progress(self):
+        for job in self:
+            line_count = done = failed = 0
+            for chunk in job.chunk_ids:
+                line_count += chunk.line_count
+                if chunk.state == 'done':
+                    done += 1
+                elif chunk.state == 'failed':
+                    failed += 1
+            chunk_count = len(job.chunk_ids)
+            if done == chunk_count:
+                state = 'done'
+            elif done + failed == chunk_count:
+                state = 'failed'
+            elif done + failed:
+                state = 'running'
+            else:
+                state = 'queued'
+            job.line_count = line_count
+            job.chunk_count = chunk_count
+            job.chunk_done_count = done
+            job.chunk_failed_count = failed
+            job.progress = chunk_count and 100.0 * (done + failed) / chunk_count or 100
+            job.state = state
+
+    @api.model
+    def _trigger_processing(self):
+        cron = self.env.ref(
+            'mooncard_payment_card.mooncard_import_job_cron',
+            raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    def retry_failed_chunks(self):
+        failed_chunks = self.chunk_ids.filtered(lambda x: x.state == 'failed')
+        if not failed_chunks:
+            raise UserError(_("There are no failed chunks to retry."))
+        failed_chunks.write({'state': 'pending', 'error': False})
+        self._trigger_processing()
+
+    def _get_records(self):
+        """Returns the transactions or mileages created or updated
+        by the job"""
+        self.ensure_one()
+        if self.file_format == 'mileage':
+            return self.chunk_ids.mileage_ids
+        return self.chunk_ids.transaction_ids
+
+    def open_result(self):
+        self.ensure_one()
+        if self.state != 'done':
+            raise UserError(_(
+                "The import job '%s' is not finished yet.") % self.display_name)
+        return self.env['mooncard.csv.import']._get_result_action(
+            self.file_format, self._get_records().ids)
+
+
+class MooncardImportJobChunk(models.Model):
+    _name = 'mooncard.import.job.chunk'
+    _description = 'Chunk of a Mooncard Import Job'
+    _order = 'job_id, sequence'
+
+    job_id = fields.Many2one(
+        'mooncard.import.job', string='Import Job', required=True,
+        ondelete='cascade', index=True)
+    sequence = fields.Integer(required=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ], default='pending', required=True, index=True)
+    line_count = fields.Integer(string='Number of Lines')
+    record_count = fields.Integer(
+        string='Number of Records', readonly=True,
+        help="Number of records created or updated by the chunk.")
+    # JSON list of the lines of the CSV file, emptied once processed
+    lines = fields.Text()
+    error = fields.Text(readonly=True)
+    date_done = fields.Datetime(readonly=True)
+    transaction_ids = fields.Many2many(
+        'newgen.payment.card.transaction', string='Transactions', readonly=True)
+    mileage_ids = fields.Many2many(
+        'mooncard.mileage', string='Mileages', readonly=True)
+
+    @api.model
+    def _cron_process_chunks(self):
+        """Import one pending chunk, then trigger the scheduled action
+        again for the next one. So each chunk is imported in its own
+        transaction by a cron worker of the server, one after the other"""
+        job_model = self.env['mooncard.import.job']
+        try:
+            chunk = self._claim_pending_chunk()
+        except pg_errors.SerializationFailure:
+            # retried by a user since the start of the transaction
+            # of the scheduled action: try again in the next run
+            self.env.cr.rollback()
+            job_model._trigger_processing()
+            return
+        if not chunk:
+            return
+        chunk._process_locked_chunk()
+        if self.search([('state', '=', 'pending')], limit=1):
+            job_model._trigger_processing()
+
+    @api.model
+    def _claim_pending_chunk(self):
+        """Lock the next pending chunk. The lock is kept until the commit,
+        so a chunk retried by a user in the meantime is skipped"""
+        self.flush_model(['state'])
+        self.env.cr.execute("""
+            SELECT id FROM mooncard_import_job_chunk
+            WHERE state = 'pending'
+            ORDER BY job_id, sequence
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED""")
+        res = self.env.cr.fetchone()
+        return self.browse(res and res[0] or [])
+
+    def _process_locked_chunk(self):
+        self.ensure_one()
+        logger.info(
+            'Processing chunk %d of Mooncard import job %s',
+            self.sequence, self.job_id.name)
+        try:
+            with self.env.cr.savepoint():
+                ids = self._import_lines()
+        except Exception as e:
+            logger.warning(
+                'Chunk %d of Mooncard import job %s failed: %s',
+                self.sequence, self.job_id.name, e)
+            self.write({'state': 'failed', 'error': str(e)})
+            return
+        vals = {
+            'state': 'done',
+            'error': False,
+            'lines': False,
+            'date_done': fields.Datetime.now(),
+            'record_count': len(set(ids)),
+            }
+        if self.job_id.file_format == 'mileage':
+            vals['mileage_ids'] = [(6, 0, ids)]
+        else:
+            vals['transaction_ids'] = [(6, 0, ids)]
+        self.write(vals)
+
+    def _import_lines(self):
+        self.ensure_one()
+        job = self.job_id
+        wizard = self.env['mooncard.csv.import'].with_user(job.user_id).with_company(
+            job.company_id).new({'company_id': job.company_id.id})
+        lines = json.loads(self.lines or '[]')
+        keys = None
+        if wizard._is_two_pass_import():
+            keys = wizard._collect_keys(lines, job.file_format)
+        speeddict = wizard._prepare_speeddict(job.file_format, keys=keys)
+        if job.file_format == 'mileage':
+            return wizard._import_mileage_lines(lines, speeddict)
+        return wizard._import_transaction_lines(lines, speeddict)
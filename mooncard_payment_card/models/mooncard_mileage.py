@@ -30,6 +30,9 @@ class MooncardMileage(models.Model):
     description = fields.Char(states={'done': [('readonly', True)]})
     unique_import_id = fields.Char(
         string='Unique Identifier', readonly=True, copy=False)
+    # hash of the line of the imported file, to skip the unchanged lines
+    # when the file is imported again
+    import_hash = fields.Char(readonly=True, copy=False)
     date = fields.Date(required=True, states={'done': [('readonly', True)]})
     departure = fields.Char(states={'done': [('readonly', True)]})
     arrival = fields.Char(states={'done': [('readonly', True)]})
@@ -129,10 +132,8 @@ class MooncardMileage(models.Model):
                 lines_by_partner[line.partner_id] = line
         if not lines_by_partner:
             raise UserError(_("Selected mileages are already processed."))
-        invoice_ids = []
-        for lines in lines_by_partner.values():
-            invoice = lines.generate_invoice_same_partner()
-            invoice_ids.append(invoice.id)
+        invoices = self._generate_invoices(list(lines_by_partner.values()))
+        invoice_ids = invoices.ids
         action = self.env['ir.actions.actions']._for_xml_id(
             'account.action_move_in_invoice_type')
         action['views'] = False
@@ -144,18 +145,37 @@ class MooncardMileage(models.Model):
             action['res_id'] = invoice_ids[0]
         return action
 
-    def prepare_invoice_line_name(self):
+    @api.model
+    def _prepare_invoice_line_formatting(self):
+        """The returned dict is shared by the lines of all the invoices
+        generated together. It memoizes the formatted dates and prices"""
+        return {
+            'trip_type_labels': dict(
+                self._fields['trip_type']._description_selection(self.env)),
+            'locale': self.env.user.lang or 'fr_FR',
+            # key = date, value = formatted date
+            'dates': {},
+            # key = (price, currency), value = formatted price
+            'prices': {},
+            }
+
+    def prepare_invoice_line_name(self, formatting=None):
         self.ensure_one()
-        triptype_key2label = dict(self.fields_get(
-            'trip_type', 'selection')['trip_type']['selection'])
+        if formatting is None:
+            formatting = self._prepare_invoice_line_formatting()
+        triptype_key2label = formatting['trip_type_labels']
         date_formatted = self.date
         if self.date:
-            date_dt = fields.Date.from_string(self.date)
-            date_formatted = format_date(
-                date_dt, format='short', locale=self.env.user.lang or 'fr_FR')
-        price_unit_formatted = formatLang(
-            self.env, self.price_unit, dp='Mileage Price',
-            monetary=True, currency_obj=self.company_id.currency_id)
+            if self.date not in formatting['dates']:
+                formatting['dates'][self.date] = format_date(
+                    self.date, format='short', locale=formatting['locale'])
+            date_formatted = formatting['dates'][self.date]
+        price_key = (self.price_unit, self.company_id.currency_id)
+        if price_key not in formatting['prices']:
+            formatting['prices'][price_key] = formatLang(
+                self.env, self.price_unit, dp='Mileage Price',
+                monetary=True, currency_obj=self.company_id.currency_id)
+        price_unit_formatted = formatting['prices'][price_key]
         name = _('%s %s: %s %s %s %s %d km\n%s %s, %s CV, %s/km\nRef: %s') % (
             date_formatted,
             self.description,
@@ -171,7 +191,9 @@ class MooncardMileage(models.Model):
             self.name)
         return name
 
-    def prepare_invoice(self):
+    def prepare_invoice(self, formatting=None):
+        if formatting is None:
+            formatting = self._prepare_invoice_line_formatting()
         date = False
         vals = {
             'partner_id': self[0].partner_id.id,
@@ -185,7 +207,7 @@ class MooncardMileage(models.Model):
             if not date or date < line.date:
                 date = line.date
             assert line.company_id.id == vals["company_id"]
-            name = line.prepare_invoice_line_name()
+            name = line.prepare_invoice_line_name(formatting=formatting)
             vals['invoice_line_ids'].append((0, 0, {
                 'price_unit': line.amount,
                 'name': name,
@@ -198,13 +220,21 @@ class MooncardMileage(models.Model):
         return vals
 
     def generate_invoice_same_partner(self):
-        amo = self.env['account.move']
-        vals = self.prepare_invoice()
-        invoice = amo.create(vals)
-        invoice.with_context(validate_analytic=True)._post(soft=False)
-        invoice.message_post(body=_(
-            "Invoice created from Mooncard mileage."))
-        self.write({
-            'invoice_id': invoice.id,
-            })
-        return invoice
+        return self._generate_invoices([self])
+
+    @api.model
+    def _generate_invoices(self, lines_list):
+        """lines_list is a list of mileages recordsets, each of them
+        with the same partner. Create and post one invoice per recordset
+        together and returns the invoices (in the same order)"""
+        formatting = self._prepare_invoice_line_formatting()
+        invoices = self.env['account.move'].create([
+            lines.prepare_invoice(formatting=formatting) for lines in lines_list])
+        invoices.with_context(validate_analytic=True)._post(soft=False)
+        invoices._message_log_batch(bodies={
+            invoice.id: _("Invoice created from Mooncard mileage.")
+            for invoice in invoices})
+        # create() returns the invoices in the order of vals_list
+        for lines, invoice in zip(lines_list, invoices):
+            lines.write({'invoice_id': invoice.id})
+        return invoices
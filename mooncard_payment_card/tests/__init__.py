@@ -0,0 +1,3 @@
+from . import test_mooncard_import
+from . import test_mooncard_import_benchmark
+from . import test_mooncard_import_job
@@ -0,0 +1,76 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import base64
+
+from odoo.tests.common import TransactionCase
+
+from . import mooncard_csv_generator as generator
+
+ACCOUNT_CODES = ['606100', '625100', '625600', '626000']
+
+
+class MooncardImportCommon(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company = cls.env.ref('base.main_company')
+        cls.company.country_id = cls.env.ref('base.fr').id
+        aao = cls.env['account.account']
+        for code in ACCOUNT_CODES:
+            if not aao.search([
+                    ('code', '=', code), ('company_id', '=', cls.company.id)]):
+                aao.create({
+                    'code': code,
+                    'name': 'Mooncard Test Expense %s' % code,
+                    'account_type': 'expense',
+                    'company_id': cls.company.id,
+                    })
+        if not cls.company.transfer_account_id:
+            cls.company.transfer_account_id = aao.create({
+                'code': '580999',
+                'name': 'Mooncard Test Internal Transfer',
+                'account_type': 'asset_current',
+                'reconcile': True,
+                'company_id': cls.company.id,
+                }).id
+
+    @classmethod
+    def _create_partners(cls, partner_count, vendor_count, matched_vendor_share=0.3):
+        """Create partner_count partners. The first ones have the name of
+        the generated vendors or their VAT number, so that they match"""
+        vendors = generator.vendor_names(vendor_count)
+        matched = int(vendor_count * matched_vendor_share)
+        vals_list = []
+        for index in range(partner_count):
+            vals = {'name': 'Mooncard Test Supplier %d' % index}
+            if index < matched:
+                if index % 2:
+                    vals['name'] = vendors[index]
+                else:
+                    vals['vat'] = generator.french_vat_number(index)
+            vals_list.append(vals)
+        return cls.env['res.partner'].create(vals_list)
+
+    @classmethod
+    def _create_employees(cls, count):
+        return cls.env['res.partner'].create([{
+            'name': 'Mooncard Test Employee %d' % index,
+            'email': 'employee%d@mooncard-test.example.com' % index,
+            } for index in range(count)])
+
+    def _import_file(self, content, filename='transactions.csv'):
+        """Import the file and returns the IDs of the created/updated
+        records and the stats of the import"""
+        wizard = self.env['mooncard.csv.import'].create({
+            'mooncard_file': base64.b64encode(content),
+            'filename': filename,
+            'company_id': self.company.id,
+            })
+        fileobj = wizard._decode_mooncard_file()
+        file_format = wizard._sniff_file_format(fileobj)
+        ids, stats = wizard._import_file(fileobj, file_format)
+        fileobj.close()
+        return ids, stats
@@ -0,0 +1,198 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+"""Generator of synthetic Mooncard CSV files, used by the tests and by
+the import benchmark"""
+
+import csv
+import io
+import random
+from datetime import date, timedelta
+
+from stdnum import luhn
+
+TRANSACTION_COLUMNS = [
+    'id', 'transaction_id', 'transaction_type', 'date_transaction',
+    'date_authorization', 'card_token', 'title', 'expense_category_name',
+    'charge_account', 'analytic_code_1', 'supplier', 'supplier_vat_number',
+    'country_code', 'amount_eur', 'vat_eur', 'vat_20_id', 'vat_10_id',
+    'vat_55_id', 'vat_21_id', 'amount_currency', 'original_currency',
+    'attachment', 'receipt_code',
+    ]
+MILEAGE_COLUMNS = [
+    'Identifiant unique', 'Date de dépense', 'Heure', 'Date de débit',
+    'Montant devise', 'Devise', 'Montant', 'Payment method', 'Pays',
+    'Adresse du marchand', 'Marchand', 'Fournisseur', 'Collaborateur',
+    'Code utilisateur', 'Description', 'Barème kilométrique', 'Distance',
+    'Type de trajet', 'Départ', 'Arrivée', 'Véhicule', 'Immatriculation',
+    'Puissance fiscale', 'Compte de charge', 'Codes analytiques',
+    ]
+VENDOR_WORDS = [
+    'SNCF', 'HOTEL', 'RESTAURANT', 'AIR', 'TAXI', 'LIBRAIRIE', 'GARAGE',
+    'PARKING', 'BOULANGERIE', 'PHARMACIE', 'CAFE', 'BRASSERIE', 'STATION',
+    'BUREAU', 'INFORMATIQUE', 'PAPETERIE', 'TRAITEUR', 'PRESSING',
+    ]
+CITIES = ['PARIS', 'LYON', 'LILLE', 'NANTES', 'MARSEILLE', 'BORDEAUX', 'GENEVE']
+# (country code, share of the transactions, VAT rate column)
+COUNTRIES = [
+    ('FR', 0.8, 'vat_20_id'), ('DEU', 0.08, False), ('ESP', 0.07, False),
+    ('US', 0.05, False)]
+VAT_COLUMNS = ['vat_20_id', 'vat_10_id', 'vat_55_id', 'vat_21_id']
+VAT_RATES = {'vat_20_id': 20, 'vat_10_id': 10, 'vat_55_id': 5.5, 'vat_21_id': 2.1}
+
+
+def vendor_names(vendor_count, seed=0):
+    """Returns vendor_count distinct vendor labels"""
+    rand = random.Random(seed)
+    names = []
+    seen = set()
+    while len(names) < vendor_count:
+        name = '%s %s %s' % (
+            rand.choice(VENDOR_WORDS), rand.choice(VENDOR_WORDS),
+            rand.choice(CITIES))
+        if len(seen) >= len(VENDOR_WORDS) ** 2 * len(CITIES):
+            name = '%s %d' % (name, len(names))
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def french_vat_number(index):
+    """Returns a valid french VAT number"""
+    base = '%08d' % (10000000 + index)
+    siren = base + luhn.calc_check_digit(base)
+    key = (12 + 3 * (int(siren) % 97)) % 97
+    return 'FR%02d%s' % (key, siren)
+
+
+def card_tokens(card_count):
+    return ['%09d' % (700000000 + i) for i in range(card_count)]
+
+
+def _pick_country(rand):
+    value = rand.random()
+    for country, share, vat_column in COUNTRIES:
+        value -= share
+        if value <= 0:
+            return country, vat_column
+    return COUNTRIES[0][0], COUNTRIES[0][2]
+
+
+def transaction_rows(
+        rows, card_count=10, vendor_count=200, account_codes=None,
+        analytic_codes=None, vat_share=0.3, load_share=0.02,
+        start_index=0, seed=0, start_date=None):
+    """Generator of the lines (as dict) of a Mooncard transactions.csv file.
+    The ID of a line only depends on its index, so 2 files generated with
+    overlapping indexes have the same lines on the overlap."""
+    tokens = card_tokens(card_count)
+    vendors = vendor_names(vendor_count, seed=seed)
+    account_codes = account_codes or ['606100', '625100', '625600', '626000']
+    analytic_codes = analytic_codes or []
+    start_date = start_date or date(2026, 1, 1)
+    for index in range(start_index, start_index + rows):
+        # the content of the line only depends on its index and the seed
+        rand = random.Random('%s-%s' % (seed, index))
+        trans_date = start_date + timedelta(days=index % 365)
+        row = dict.fromkeys(TRANSACTION_COLUMNS, '')
+        row.update({
+            'id': 'bench-%08d-%04x' % (index, seed),
+            'date_transaction': '%s 10:00:00' % trans_date,
+            'card_token': rand.choice(tokens),
+            })
+        if rand.random() < load_share:
+            amount = rand.randint(1000, 5000)
+            row.update({
+                'transaction_type': 'L',
+                'title': 'Load',
+                'amount_eur': '%.2f' % amount,
+                'amount_currency': '%.2f' % amount,
+                'original_currency': 'EUR',
+                'vat_eur': '0.00',
+                })
+            yield row
+            continue
+        amount = -rand.randint(100, 50000) / 100.0
+        country, vat_column = _pick_country(rand)
+        vat = 0.0
+        if vat_column:
+            vat_column = rand.choice(VAT_COLUMNS)
+            rate = VAT_RATES[vat_column]
+            vat = round(amount * rate / (100 + rate), 2)
+            row[vat_column] = '%.2f' % vat
+        vendor_index = rand.randrange(vendor_count)
+        vendor = vendors[vendor_index]
+        row.update({
+            'transaction_type': 'P',
+            'date_authorization': '%s 13:35:06 UTC' % (trans_date - timedelta(days=1)),
+            'title': 'Expense %d' % index,
+            'expense_category_name': 'Category %d' % (index % 12),
+            'charge_account': rand.choice(account_codes),
+            'analytic_code_1': analytic_codes and rand.choice(analytic_codes) or '',
+            'supplier': vendor,
+            'supplier_vat_number': (
+                country == 'FR' and rand.random() < vat_share and
+                french_vat_number(vendor_index) or ''),
+            'country_code': country,
+            'amount_eur': '%.2f' % amount,
+            'vat_eur': '%.2f' % vat,
+            'amount_currency': '%.2f' % amount,
+            'original_currency': 'EUR',
+            'attachment': 'https://receipts.example.com/%s.jpg' % row['id'],
+            'receipt_code': 'R%08d' % index,
+            })
+        yield row
+
+
+def transactions_csv(rows, **kwargs):
+    """Returns the content (bytes) of a Mooncard transactions.csv file"""
+    output = io.StringIO()
+    writer = csv.DictWriter(
+        output, fieldnames=TRANSACTION_COLUMNS, delimiter=',',
+        quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+    writer.writeheader()
+    for row in transaction_rows(rows, **kwargs):
+        writer.writerow(row)
+    return output.getvalue().encode('utf8')
+
+
+def mileage_rows(
+        rows, emails, account_codes=None, start_index=0, seed=0,
+        start_date=None):
+    """Generator of the lines (as dict) of a Mooncard mileage file"""
+    account_codes = account_codes or ['625100']
+    start_date = start_date or date(2026, 1, 1)
+    for index in range(start_index, start_index + rows):
+        rand = random.Random('mileage-%s-%s' % (seed, index))
+        exp_date = start_date + timedelta(days=index % 365)
+        row = dict.fromkeys(MILEAGE_COLUMNS, '')
+        row.update({
+            'Identifiant unique': 'bench-km-%08d-%04x' % (index, seed),
+            'Date de dépense': exp_date.strftime('%d/%m/%y'),
+            'Code utilisateur': rand.choice(emails),
+            'Description': 'Customer visit %d' % index,
+            'Barème kilométrique': '0.636',
+            'Distance': str(rand.randint(5, 800)),
+            'Type de trajet': rand.choice(['Aller Simple', 'Aller / Retour']),
+            'Départ': rand.choice(CITIES).title(),
+            'Arrivée': rand.choice(CITIES).title(),
+            'Véhicule': 'Peugeot 308',
+            'Immatriculation': 'AB-%03d-CD' % (index % 1000),
+            'Puissance fiscale': '5',
+            'Compte de charge': rand.choice(account_codes),
+            })
+        yield row
+
+
+def mileage_csv(rows, emails, **kwargs):
+    """Returns the content (bytes) of a Mooncard mileage file"""
+    output = io.StringIO()
+    writer = csv.DictWriter(
+        output, fieldnames=MILEAGE_COLUMNS, delimiter=';',
+        quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+    writer.writeheader()
+    for row in mileage_rows(rows, emails, **kwargs):
+        writer.writerow(row)
+    return output.getvalue().encode('latin1')
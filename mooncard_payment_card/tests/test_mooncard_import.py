@@ -0,0 +1,236 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import base64
+import io
+from unittest.mock import patch
+
+from odoo.tools.safe_eval import safe_eval
+
+from . import mooncard_csv_generator as generator
+from .common import MooncardImportCommon, ACCOUNT_CODES
+
+
+class TestMooncardImport(MooncardImportCommon):
+
+    def test_import_transactions(self):
+        self._create_partners(20, 10, matched_vendor_share=1)
+        content = generator.transactions_csv(
+            30, card_count=2, vendor_count=10, account_codes=ACCOUNT_CODES)
+        ids, stats = self._import_file(content)
+        self.assertEqual(len(ids), 30)
+        self.assertEqual(stats['lines'], 30)
+        transactions = self.env['newgen.payment.card.transaction'].browse(ids)
+        self.assertEqual(len(transactions.card_id), 2)
+        expenses = transactions.filtered(lambda x: x.transaction_type == 'expense')
+        self.assertTrue(expenses)
+        self.assertTrue(all(trans.expense_account_id for trans in expenses))
+        self.assertTrue(all(trans.partner_id for trans in expenses))
+        # re-import with 10 new lines
+        content = generator.transactions_csv(
+            30, card_count=2, vendor_count=10, account_codes=ACCOUNT_CODES,
+            start_index=10)
+        ids2, stats = self._import_file(content)
+        self.assertEqual(len(ids2), 30)
+        self.assertEqual(len(set(ids) & set(ids2)), 20)
+
+    def test_import_mileage(self):
+        employees = self._create_employees(3)
+        content = generator.mileage_csv(
+            10, employees.mapped('email'), account_codes=ACCOUNT_CODES)
+        ids, stats = self._import_file(content, filename='mileage.csv')
+        self.assertEqual(len(ids), 10)
+        mileages = self.env['mooncard.mileage'].browse(ids)
+        self.assertTrue(mileages.partner_id <= employees)
+        self.assertTrue(all(mileage.amount > 0 for mileage in mileages))
+
+    def test_mileage_invoices(self):
+        employees = self._create_employees(3)
+        content = generator.mileage_csv(
+            12, employees.mapped('email'), account_codes=ACCOUNT_CODES)
+        ids, stats = self._import_file(content, filename='mileage.csv')
+        mileages = self.env['mooncard.mileage'].browse(ids)
+        copies = self.env['mooncard.mileage']
+        for mileage in mileages:
+            copies |= mileage.copy()
+        self.assertGreater(len(mileages.partner_id), 1)
+        # all the partners together
+        action = mileages.process_line()
+        invoices = self.env['account.move'].search(
+            safe_eval(action['domain']))
+        self.assertEqual(len(invoices), len(mileages.partner_id))
+        # one partner after the other
+        loop_invoices = self.env['account.move']
+        for partner in copies.partner_id:
+            loop_invoices |= copies.filtered(
+                lambda x: x.partner_id == partner).generate_invoice_same_partner()
+
+        def invoice_data(invoice, mileages):
+            lines = []
+            for line in invoice.invoice_line_ids:
+                name = line.name
+                for mileage in mileages:
+                    name = name.replace(mileage.name, '')
+                lines.append((
+                    name, line.price_unit, line.quantity, line.account_id,
+                    line.analytic_distribution, line.tax_ids))
+            return {
+                'state': invoice.state,
+                'move_type': invoice.move_type,
+                'invoice_date': invoice.invoice_date,
+                'currency': invoice.currency_id,
+                'amount_total': invoice.amount_total,
+                'invoice_origin': invoice.invoice_origin,
+                'lines': lines,
+                'messages': invoice.message_ids.filtered(
+                    lambda x: x.message_type == 'notification').mapped('body'),
+                }
+
+        for partner in mileages.partner_id:
+            partner_mileages = mileages.filtered(
+                lambda x: x.partner_id == partner)
+            partner_copies = copies.filtered(lambda x: x.partner_id == partner)
+            invoice = invoices.filtered(lambda x: x.partner_id == partner)
+            loop_invoice = loop_invoices.filtered(
+                lambda x: x.partner_id == partner)
+            self.assertEqual(len(invoice), 1)
+            self.assertEqual(partner_mileages.invoice_id, invoice)
+            self.assertEqual(partner_copies.invoice_id, loop_invoice)
+            self.assertEqual(
+                invoice_data(invoice, partner_mileages),
+                invoice_data(loop_invoice, partner_copies))
+            self.assertEqual(invoice.state, 'posted')
+        self.assertTrue(all(m.state == 'done' for m in mileages | copies))
+
+    def test_search_read_normalized_in(self):
+        npcto = self.env['newgen.payment.card.transaction']
+        employees = self._create_employees(2)
+        employees[0].write({'email': '  Employee0@Mooncard-Test.example.com '})
+        res = npcto._search_read_normalized_in(
+            'res.partner', 'email', [
+                'employee0@mooncard-test.example.com',
+                'employee1@mooncard-test.example.com',
+                'employee_@mooncard-test.example.com',
+                ], [('email', '!=', False)])
+        self.assertEqual(res, {
+            'employee0@mooncard-test.example.com': employees[0].id,
+            'employee1@mooncard-test.example.com': employees[1].id,
+            })
+
+    def test_two_pass_speeddict(self):
+        self._create_partners(20, 10, matched_vendor_share=1)
+        content = generator.transactions_csv(
+            30, card_count=2, vendor_count=10, account_codes=ACCOUNT_CODES)
+        self._import_file(content)
+        wizard = self.env['mooncard.csv.import'].new({'company_id': self.company.id})
+        lines = list(wizard._iter_file_lines(io.BytesIO(content), 'transaction'))
+        keys = wizard._collect_keys(lines, 'transaction')
+        speeddict = wizard._prepare_speeddict('transaction', keys=keys)
+        full_speeddict = wizard.with_context(
+            newgen_speeddict_no_cache=True)._prepare_speeddict('transaction')
+        self.assertEqual(len(speeddict['tokens']), 2)
+        for token, card_id in speeddict['tokens'].items():
+            self.assertEqual(full_speeddict['tokens'][token], card_id)
+        for country_code, country_id in speeddict['countries'].items():
+            self.assertEqual(full_speeddict['countries'][country_code], country_id)
+        self.assertEqual(speeddict['currencies'], {
+            'EUR': full_speeddict['currencies']['EUR']})
+
+    def test_normalize_transaction_lines(self):
+        wizard = self.env['mooncard.csv.import'].new({'company_id': self.company.id})
+        speeddict = wizard._prepare_speeddict('transaction')
+        line = {
+            'id': 'norm-1', 'transaction_type': 'P', 'supplier': ' SNCF ',
+            'supplier_vat_number': 'FR 40303265045', 'country_code': 'FRA',
+            'date_authorization': '2026-04-18 13:35:06 UTC',
+            'vat_eur': '-3.5', 'amount_eur': '-35.40', 'amount_currency': False,
+            'vat_20_id': False, 'vat_10_id': '-3.5', 'vat_55_id': False,
+            'vat_21_id': False,
+            }
+        lines = [dict(line), dict(line, id='norm-2')]
+        norms = wizard._normalize_transaction_lines(lines, speeddict)
+        self.assertEqual(lines[0]['amount_eur'], -35.40)
+        self.assertEqual(lines[1]['amount_currency'], 0.0)
+        self.assertEqual(norms[0], norms[1])
+        self.assertEqual(norms[0]['vendor'], 'SNCF')
+        self.assertEqual(norms[0]['vendor_vat'], 'FR40303265045')
+        self.assertEqual(norms[0]['country_id'], self.env.ref('base.fr').id)
+        self.assertEqual(norms[0]['vat_rate'], '10.0')
+        self.assertEqual(norms[0]['payment_date'].hour, 13)
+        # converted once for the 2 lines
+        self.assertEqual(len(speeddict['memo']['country']), 1)
+        self.assertEqual(len(speeddict['memo']['payment_date']), 1)
+
+    def test_reimport_unchanged_lines(self):
+        self._create_partners(20, 10, matched_vendor_share=1)
+        content = generator.transactions_csv(
+            30, card_count=2, vendor_count=10, account_codes=ACCOUNT_CODES)
+        ids, stats = self._import_file(content)
+        transactions = self.env['newgen.payment.card.transaction'].browse(ids)
+        self.assertTrue(all(trans.import_hash for trans in transactions))
+        # the unchanged lines are not prepared again
+        ids2, stats = self._import_file(content)
+        self.assertEqual(sorted(ids2), sorted(ids))
+        self.assertNotIn('prepare', stats['timings'])
+
+    def test_reimport_write_changed_fields(self):
+        npcto = self.env['newgen.payment.card.transaction']
+        self._create_partners(20, 10, matched_vendor_share=1)
+        content = generator.transactions_csv(
+            20, card_count=2, vendor_count=10, account_codes=ACCOUNT_CODES)
+        ids, stats = self._import_file(content)
+        transactions = npcto.browse(ids)
+        # the lines are prepared again, but don't change the transactions
+        transactions.write({'import_hash': False})
+        write = type(npcto).write
+        with patch.object(
+                type(npcto), 'write', autospec=True,
+                side_effect=write) as write_mock:
+            ids2, stats = self._import_file(content)
+            self.assertIn('prepare', stats['timings'])
+            self.assertEqual(write_mock.call_count, 0)
+        self.assertEqual(sorted(ids2), sorted(ids))
+        # only the modified field is written
+        changed = transactions[0]
+        description = changed.description
+        transactions.write({'import_hash': False})
+        changed.write({'description': 'Modified in Odoo'})
+        with patch.object(
+                type(npcto), 'write', autospec=True,
+                side_effect=write) as write_mock:
+            self._import_file(content)
+            self.assertEqual(write_mock.call_count, 1)
+            records, vals = write_mock.call_args[0]
+            self.assertEqual(records, changed)
+            self.assertEqual(vals, {'description': description})
+        self.assertEqual(changed.description, description)
+
+    def test_reimport_same_file(self):
+        npcto = self.env['newgen.payment.card.transaction']
+        content = generator.transactions_csv(
+            10, card_count=1, vendor_count=5, account_codes=ACCOUNT_CODES)
+        wizard_vals = {
+            'mooncard_file': base64.b64encode(content),
+            'filename': 'transactions.csv',
+            'company_id': self.company.id,
+            }
+        action = self.env['mooncard.csv.import'].create(
+            wizard_vals).mooncard_import()
+        transactions = npcto.search(safe_eval(action['domain']))
+        self.assertEqual(len(transactions), 10)
+        # a synchronous import doesn't create an import job
+        self.assertFalse(self.env['mooncard.import.job'].search([]))
+        # the records deleted or modified since the previous import
+        # are imported again
+        deleted_import_id = transactions[0].unique_import_id
+        transactions[0].unlink()
+        transactions[1].write({'import_hash': False})
+        action2 = self.env['mooncard.csv.import'].create(
+            wizard_vals).mooncard_import()
+        transactions2 = npcto.search(safe_eval(action2['domain']))
+        self.assertEqual(len(transactions2), 10)
+        self.assertIn(
+            deleted_import_id, transactions2.mapped('unique_import_id'))
+        self.assertEqual(transactions2 & transactions, transactions[1:])
+        self.assertTrue(all(trans.import_hash for trans in transactions2))
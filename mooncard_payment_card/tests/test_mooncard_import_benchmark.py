@@ -0,0 +1,128 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+"""Benchmark of the Mooncard import. It is not run by default: run it with
+--test-tags mooncard_benchmark and set the size of the benchmark with the
+environment variables:
+- MOONCARD_BENCH_ROWS: number of lines of the transactions file (2000)
+- MOONCARD_BENCH_CARDS: number of cards (20)
+- MOONCARD_BENCH_VENDORS: number of distinct vendors (500)
+- MOONCARD_BENCH_PARTNERS: number of partners to create (5000)
+- MOONCARD_BENCH_REIMPORT: share of the lines of the second file that
+  are already imported by the first file (0.5)
+- MOONCARD_BENCH_MILEAGE_ROWS: number of lines of the mileage file (1000)
+- MOONCARD_BENCH_INDEX_NAMES: number of partner names of the partner name
+  index (200000)
+- MOONCARD_BENCH_INDEX_SECONDS: maximum time to build the partner name
+  index (10)
+- MOONCARD_BENCH_INDEX_MB: maximum memory used to build the partner name
+  index, in MB (128)
+"""
+
+import logging
+import os
+import time
+import tracemalloc
+
+from odoo.tests import tagged
+from odoo.addons.base_newgen_payment_card.tools import PartnerNameIndex
+
+from . import mooncard_csv_generator as generator
+from .common import MooncardImportCommon, ACCOUNT_CODES
+
+logger = logging.getLogger(__name__)
+
+
+def _env_param(name, default, convert=int):
+    return convert(os.environ.get('MOONCARD_BENCH_%s' % name, default))
+
+
+@tagged('post_install', '-at_install', '-standard', 'mooncard_benchmark')
+class TestMooncardImportBenchmark(MooncardImportCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.rows = _env_param('ROWS', 2000)
+        cls.cards = _env_param('CARDS', 20)
+        cls.vendors = _env_param('VENDORS', 500)
+        cls.partners = _env_param('PARTNERS', 5000)
+        cls.reimport_share = _env_param('REIMPORT', 0.5, float)
+        cls.mileage_rows = _env_param('MILEAGE_ROWS', 1000)
+        start = time.perf_counter()
+        cls._create_partners(cls.partners, cls.vendors)
+        cls.employees = cls._create_employees(max(cls.mileage_rows // 20, 1))
+        logger.info(
+            'Benchmark setup: %d partners created in %.2fs',
+            cls.partners, time.perf_counter() - start)
+
+    def _report(self, title, stats):
+        logger.info(
+            'BENCHMARK %s: %d lines in %.2fs => %.1f lines/s',
+            title, stats['lines'], stats['duration'], stats['lines_per_second'])
+        for phase, timing in sorted(stats['timings'].items()):
+            logger.info(
+                'BENCHMARK %s: %-17s %8.3fs (%5.1f%%)', title, phase, timing,
+                stats['duration'] and 100 * timing / stats['duration'] or 0)
+
+    def test_benchmark_transactions(self):
+        params = {
+            'card_count': self.cards,
+            'vendor_count': self.vendors,
+            'account_codes': ACCOUNT_CODES,
+            }
+        content = generator.transactions_csv(self.rows, **params)
+        ids, stats = self._import_file(content)
+        self._report('transactions (new)', stats)
+        self.assertEqual(len(ids), self.rows)
+        # Second file: the first lines overlap with the first file
+        start_index = int(self.rows * (1 - self.reimport_share))
+        content = generator.transactions_csv(
+            self.rows, start_index=start_index, **params)
+        ids, stats = self._import_file(content)
+        self._report(
+            'transactions (%d%% re-imported)' % (100 * self.reimport_share), stats)
+        self.assertEqual(len(ids), self.rows)
+
+    def test_benchmark_mileage(self):
+        content = generator.mileage_csv(
+            self.mileage_rows, self.employees.mapped('email'),
+            account_codes=ACCOUNT_CODES)
+        ids, stats = self._import_file(content, filename='mileage.csv')
+        self._report('mileage', stats)
+        self.assertEqual(len(ids), self.mileage_rows)
+
+    def test_benchmark_partner_name_index(self):
+        name_count = _env_param('INDEX_NAMES', 200000)
+        max_seconds = _env_param('INDEX_SECONDS', 10, float)
+        max_mb = _env_param('INDEX_MB', 128, float)
+        names = [
+            (name.upper(), index) for index, name in enumerate(
+                generator.vendor_names(name_count))]
+        vendors = [name.upper() for name in generator.vendor_names(
+            self.vendors, seed=1)]
+        start = time.perf_counter()
+        index = PartnerNameIndex(names)
+        build_duration = time.perf_counter() - start
+        start = time.perf_counter()
+        for vendor in vendors:
+            index.match_contain(vendor)
+            # part of a partner name
+            index.match_contain(vendor[2:-2])
+        match_duration = time.perf_counter() - start
+        del index
+        tracemalloc.start()
+        try:
+            index = PartnerNameIndex(names)
+            kept_size, peak_size = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        logger.info(
+            'BENCHMARK partner name index: %d names (%d characters) built '
+            'in %.2fs, %.1f MB kept, %.1f MB peak; %d matches in %.3fs',
+            len(index), sum(len(name) for name, _partner_id in names),
+            build_duration, kept_size / 1024 ** 2, peak_size / 1024 ** 2,
+            2 * len(vendors), match_duration)
+        self.assertLess(build_duration, max_seconds)
+        self.assertLess(peak_size / 1024 ** 2, max_mb)
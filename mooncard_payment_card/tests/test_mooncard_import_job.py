@@ -0,0 +1,116 @@
+# Copyright 2026 Akretion France (http://www.akretion.com/)
+# @author: Alexis de Lattre <alexis.delattre@akretion.com>
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import base64
+import json
+from unittest.mock import patch
+
+from . import mooncard_csv_generator as generator
+from .common import MooncardImportCommon, ACCOUNT_CODES
+
+
+class TestMooncardImportJob(MooncardImportCommon):
+
+    def setUp(self):
+        super().setUp()
+        self.env['ir.config_parameter'].sudo().set_param(
+            'mooncard.import_create_chunk_size', 10)
+        self.chunk_model = self.env['mooncard.import.job.chunk']
+
+    def _queue_job(self, content):
+        wizard = self.env['mooncard.csv.import'].create({
+            'mooncard_file': base64.b64encode(content),
+            'filename': 'transactions.csv',
+            'company_id': self.company.id,
+            'background': True,
+            })
+        action = wizard.mooncard_import()
+        return self.env['mooncard.import.job'].browse(action['res_id'])
+
+    def _process_pending_chunks(self):
+        # what the scheduled action does when it is triggered again
+        # after each run
+        while self.chunk_model.search([('state', '=', 'pending')], limit=1):
+            self.chunk_model._cron_process_chunks()
+
+    def test_queue_and_process_job(self):
+        content = generator.transactions_csv(
+            25, card_count=3, vendor_count=5, account_codes=ACCOUNT_CODES)
+        job = self._queue_job(content)
+        self.assertEqual(job.state, 'queued')
+        self.assertEqual(job.chunk_count, 3)
+        self.assertEqual(job.line_count, 25)
+        self.assertEqual(job.chunk_ids.mapped('sequence'), [0, 1, 2])
+        # the cards are created when the job is queued, not by the chunks
+        tokens = set()
+        for chunk in job.chunk_ids:
+            tokens.update(line['card_token'] for line in json.loads(chunk.lines))
+        cards = self.env['newgen.payment.card'].search([
+            ('company_id', '=', self.company.id), ('name', 'in', list(tokens))])
+        self.assertEqual(len(cards), len(tokens))
+        # chunks are claimed in order
+        chunk = self.chunk_model._claim_pending_chunk()
+        self.assertEqual(chunk, job.chunk_ids[0])
+        chunk._process_locked_chunk()
+        self.assertEqual(chunk.state, 'done')
+        self.assertFalse(chunk.lines)
+        self.assertEqual(chunk.record_count, 10)
+        self.assertEqual(job.state, 'running')
+        self.assertEqual(self.chunk_model._claim_pending_chunk(), job.chunk_ids[1])
+        self._process_pending_chunks()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.progress, 100)
+        transactions = job._get_records()
+        self.assertEqual(len(transactions), 25)
+        self.assertEqual(transactions.card_id, cards)
+        self.assertTrue(job.open_result()['domain'])
+
+    def test_chunk_failure(self):
+        content = generator.transactions_csv(
+            25, card_count=2, vendor_count=5, account_codes=ACCOUNT_CODES)
+        job = self._queue_job(content)
+        failing_chunk = job.chunk_ids[1]
+        lines = json.loads(failing_chunk.lines)
+        transaction_type = lines[0]['transaction_type']
+        lines[0]['transaction_type'] = 'X'
+        failing_chunk.lines = json.dumps(lines)
+        self._process_pending_chunks()
+        self.assertEqual(failing_chunk.state, 'failed')
+        self.assertIn("Wrong transaction type 'X'", failing_chunk.error)
+        # the failed chunk is rolled back, the others are imported
+        self.assertFalse(failing_chunk.transaction_ids)
+        self.assertEqual(len(job._get_records()), 15)
+        self.assertEqual(job.state, 'failed')
+        # fix the line and retry
+        lines[0]['transaction_type'] = transaction_type
+        failing_chunk.lines = json.dumps(lines)
+        job.retry_failed_chunks()
+        self.assertEqual(failing_chunk.state, 'pending')
+        self._process_pending_chunks()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(len(job._get_records()), 25)
+
+    def test_cron_process_chunks(self):
+        content = generator.transactions_csv(
+            25, card_count=2, vendor_count=5, account_codes=ACCOUNT_CODES)
+        job = self._queue_job(content)
+        cron_model = type(self.env['ir.cron'])
+        with patch.object(cron_model, '_trigger', autospec=True) as trigger:
+            # one chunk per run, triggered again while chunks are pending
+            self.chunk_model._cron_process_chunks()
+            self.assertEqual(
+                job.chunk_ids.mapped('state'), ['done', 'pending', 'pending'])
+            self.assertEqual(trigger.call_count, 1)
+            self.assertEqual(
+                trigger.call_args[0][0],
+                self.env.ref('mooncard_payment_card.mooncard_import_job_cron'))
+            self.chunk_model._cron_process_chunks()
+            self.assertEqual(trigger.call_count, 2)
+            self.chunk_model._cron_process_chunks()
+            self.assertEqual(job.state, 'done')
+            self.assertEqual(trigger.call_count, 2)
+            # nothing left to do
+            self.chunk_model._cron_process_chunks()
+            self.assertEqual(trigger.call_count, 2)
+        self.assertEqual(len(job._get_records()), 25)
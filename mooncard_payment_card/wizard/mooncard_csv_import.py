@@ -4,7 +4,7 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
-from odoo.tools import float_compare, float_is_zero
+from odoo.tools import float_compare, float_is_zero, split_every, str2bool
 from datetime import datetime
 import unicodecsv
 from unidecode import unidecode
@@ -13,11 +13,34 @@ from stdnum.vatin import is_valid
 import logging
 import pycountry
 import base64
+import hashlib
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
 from odoo.addons.base_newgen_payment_card.models.newgen_payment_card_transaction\
     import MEANINGFUL_PARTNER_NAME_MIN_SIZE
 
 logger = logging.getLogger(__name__)
 
+# Max number of values in the IN clause used to search existing records
+IMPORT_ID_SEARCH_CHUNK = 1000
+# Number of lines read from the file and created with one multi-create
+# (can be changed with the system parameter mooncard.import_create_chunk_size)
+DEFAULT_CREATE_CHUNK_SIZE = 500
+# Size of the blocks of base64 decoded at once (must be a multiple of 4)
+B64_DECODE_BLOCK_SIZE = 4 * 256 * 1024
+# Columns of the transactions file converted to float
+TRANSACTION_FLOAT_FIELDS = [
+    'vat_eur', 'amount_eur', 'amount_currency',
+    'vat_20_id', 'vat_10_id', 'vat_55_id', 'vat_21_id']
+# Columns of the VAT amount per rate, by order of precedence
+# when several rates have the same amount
+VAT_RATE_FIELDS = [
+    ('2.1', 'vat_21_id'), ('5.5', 'vat_55_id'), ('10.0', 'vat_10_id'),
+    ('20.0', 'vat_20_id')]
+MILEAGE_HEADER = 'Identifiant unique;Date de dépense;Heure;Date de débit;Montant devise;Devise;Montant;Payment method;Pays;Adresse du marchand;Marchand;Fournisseur;Collaborateur'  # noqa: E501
+
 
 class MooncardCsvImport(models.TransientModel):
     _name = 'mooncard.csv.import'
@@ -28,6 +51,10 @@ class MooncardCsvImport(models.TransientModel):
     company_id = fields.Many2one(
         'res.company', string='Company', required=True,
         default=lambda self: self.env.company)
+    background = fields.Boolean(
+        string='Import in Background',
+        help="If enabled, the file is split in chunks that are imported "
+        "by a scheduled action. Recommended for big files.")
 
     @api.model
     def partner_match(self, vendor, speed_entry, partner_match_rule='contain'):
@@ -43,34 +70,193 @@ class MooncardCsvImport(models.TransientModel):
                 return False
         return False
 
-    def _prepare_transaction(self, line, speeddict, action='create'):
-        bdio = self.env['business.document.import']
-        npco = self.env['newgen.payment.card']
-        analytic_distribution = expense_account_id = card_id = partner_id = False
-        vendor_vat = False
-        # convert to float
-        float_fields = [
-            'vat_eur', 'amount_eur', 'amount_currency',
-            'vat_20_id', 'vat_10_id', 'vat_55_id', 'vat_21_id']
-        for float_field in float_fields:
-            if line.get(float_field):
+    @api.model
+    def _match_partner(self, vendor, vendor_vat, speeddict):
+        partner_id = False
+        # Partner matching
+        # 1. Try to match on VAT
+        if vendor_vat and vendor_vat in speeddict['partner_vat']:
+            partner_id = speeddict['partner_vat'][vendor_vat]
+            logger.debug('Partner ID %d matched on VAT %s', partner_id, vendor_vat)
+
+        if (
+                not partner_id and
+                vendor and
+                len(vendor) >= MEANINGFUL_PARTNER_NAME_MIN_SIZE):
+            # 2. Try to match on labels : exact match
+            vendor_label = unidecode(vendor).upper()
+            if vendor_label in speeddict['partner_labels']:
+                partner_id = speeddict['partner_labels'][vendor_label]
+                logger.debug(
+                    'Partner ID %d matched on label %s', partner_id, vendor_label)
+
+            # 3. Try to match on partner name (configurable)
+            if (
+                    not partner_id and
+                    speeddict['partner_match_rule'] and
+                    speeddict['partner_match_rule'] != 'False'):
+                partner_id = speeddict['partner_name_index'].match(
+                    vendor_label, speeddict['partner_match_rule'])
+                if partner_id:
+                    logger.debug(
+                        "Partner ID %d matched on name '%s' with "
+                        "partner_match_rule=%s",
+                        partner_id, vendor_label,
+                        speeddict['partner_match_rule'])
+        return partner_id
+
+    @api.model
+    def _get_import_memo(self, speeddict, name):
+        """Returns the dict used to memoize a conversion during the
+        import (the speeddict is built for each import)"""
+        return speeddict.setdefault('memo', {}).setdefault(name, {})
+
+    @api.model
+    def _convert_float_column(self, lines, float_field):
+        column = [line.get(float_field) for line in lines]
+        try:
+            column = [value and float(value) or 0.0 for value in column]
+        except (ValueError, TypeError):
+            for value in column:
                 try:
-                    line[float_field] = float(line[float_field])
-                except Exception:
+                    float(value or 0.0)
+                except (ValueError, TypeError):
                     raise UserError(_(
                         "Cannot convert float field '%s' with value '%s'.")
-                        % (float_field, line.get(float_field)))
-            else:
-                line[float_field] = 0.0
-        total_vat_rates = line['vat_20_id'] + line['vat_10_id'] +\
-            line['vat_55_id'] + line['vat_21_id']
-        if float_compare(line['vat_eur'], total_vat_rates, precision_digits=2):
-            logger.warning(
-                "In the Mooncard CSV file: for transaction ID '%s' "
-                "the column 'vat_eur' (%.2f) doesn't have the same value "
-                "as the sum of the 4 columns per VAT rate (%.2f). Check "
-                "that it is foreign VAT.",
-                line['id'], line['vat_eur'], total_vat_rates)
+                        % (float_field, value))
+        for line, value in zip(lines, column):
+            line[float_field] = value
+
+    @api.model
+    def _normalize_vendor_vat(self, supplier_vat_number):
+        raw_vat = supplier_vat_number.strip().replace(' ', '').upper()
+        if is_valid(raw_vat):
+            return raw_vat
+        logger.warning("Supplier VAT number %s is invalid.", raw_vat)
+        return False
+
+    @api.model
+    def _normalize_country_code(self, country_code, speeddict):
+        country_id = False
+        if len(country_code) == 2:
+            country_id = speeddict['countries'].get(country_code)
+        elif len(country_code) == 3:
+            logger.debug(
+                'search country with code %s with pycountry', country_code)
+            pcountry = pycountry.countries.get(alpha_3=country_code)
+            if pcountry and pcountry.alpha_2:
+                country_id = speeddict['countries'].get(pcountry.alpha_2)
+        elif len(country_code) > 3:
+            # Workaround Mooncard bug, fixed by mooncard on 20/09/2022
+            country_name = unidecode(country_code.strip()).lower()
+            if country_name in speeddict['country_names']:
+                country_id = speeddict['country_names'][country_name]
+        return country_id
+
+    @api.model
+    def _normalize_payment_date(self, date_authorization):
+        # Mooncard now always gives us datetime in UTC
+        # example : 2019-04-18 13:35:06 UTC
+        return datetime.strptime(date_authorization, '%Y-%m-%d %H:%M:%S %Z')
+
+    def _normalize_transaction_lines(self, lines, speeddict):
+        """Convert the columns of a chunk of lines, one column at a time.
+        The amounts are converted in place. Returns the list of the dicts
+        of the values derived from each line (vendor, VAT number,
+        country, payment date and VAT rate). These conversions only
+        depend on the value of the column, so they are memoized for
+        the whole import: a vendor or a country that appears on many
+        lines is only converted once"""
+        for float_field in TRANSACTION_FLOAT_FIELDS:
+            self._convert_float_column(lines, float_field)
+        vat_memo = self._get_import_memo(speeddict, 'vendor_vat')
+        country_memo = self._get_import_memo(speeddict, 'country')
+        date_memo = self._get_import_memo(speeddict, 'payment_date')
+        res = []
+        for line in lines:
+            total_vat_rates = line['vat_20_id'] + line['vat_10_id'] +\
+                line['vat_55_id'] + line['vat_21_id']
+            if float_compare(
+                    line['vat_eur'], total_vat_rates, precision_digits=2):
+                logger.warning(
+                    "In the Mooncard CSV file: for transaction ID '%s' "
+                    "the column 'vat_eur' (%.2f) doesn't have the same value "
+                    "as the sum of the 4 columns per VAT rate (%.2f). Check "
+                    "that it is foreign VAT.",
+                    line['id'], line['vat_eur'], total_vat_rates)
+            # rate with the highest VAT amount
+            vat_rate = 0
+            if not float_is_zero(line['vat_eur'], precision_digits=2):
+                max_amount = -1
+                for rate, rate_field in VAT_RATE_FIELDS:
+                    if abs(line[rate_field]) > max_amount:
+                        vat_rate, max_amount = rate, abs(line[rate_field])
+            vendor_vat = False
+            raw_vat = line.get('supplier_vat_number')
+            if raw_vat and raw_vat.strip():
+                if raw_vat not in vat_memo:
+                    vat_memo[raw_vat] = self._normalize_vendor_vat(raw_vat)
+                vendor_vat = vat_memo[raw_vat]
+            country_id = False
+            country_code = line.get('country_code')
+            if country_code:
+                if country_code not in country_memo:
+                    country_memo[country_code] = self._normalize_country_code(
+                        country_code, speeddict)
+                country_id = country_memo[country_code]
+            payment_date = False
+            date_authorization = line.get('date_authorization')
+            if line.get('transaction_type') == 'P' and date_authorization:
+                if date_authorization not in date_memo:
+                    date_memo[date_authorization] =\
+                        self._normalize_payment_date(date_authorization)
+                payment_date = date_memo[date_authorization]
+            res.append({
+                'vendor': line.get('supplier') and line['supplier'].strip(),
+                'vendor_vat': vendor_vat,
+                'country_id': country_id,
+                'payment_date': payment_date,
+                'vat_rate': vat_rate,
+                })
+        return res
+
+    def _get_or_create_cards(self, tokens):
+        """Create the cards of the tokens which don't exist in the company
+        (archived cards included: a token is unique in a company).
+        Returns a dict with key = token and value = card ID"""
+        self.ensure_one()
+        npco = self.env['newgen.payment.card'].sudo().with_context(
+            active_test=False)
+        res = {}
+        for sub_tokens in split_every(IMPORT_ID_SEARCH_CHUNK, list(set(tokens)), list):
+            for card in npco.search_read([
+                    ('company_id', '=', self.company_id.id),
+                    ('name', 'in', sub_tokens),
+                    ], ['name']):
+                res[card['name']] = card['id']
+        missing_tokens = sorted(set(tokens) - set(res))
+        if not missing_tokens:
+            return res
+        existing_card = npco.search([
+            ('company_id', '=', self.company_id.id),
+            ('journal_id', '!=', False),
+            ], limit=1, order='id desc')
+        journal_id = existing_card and existing_card.journal_id.id or False
+        cards = npco.create([{
+            'name': token,
+            'company_id': self.company_id.id,
+            'journal_id': journal_id,
+            } for token in missing_tokens])
+        res.update({card.name: card.id for card in cards})
+        return res
+
+    def _prepare_transaction(self, line, speeddict, action='create', norm=None):
+        """norm is the dict of the values derived from the line by
+        _normalize_transaction_lines() (computed here if not given)"""
+        bdio = self.env['business.document.import']
+        analytic_distribution = expense_account_id = card_id = partner_id = False
+        if norm is None:
+            norm = self._normalize_transaction_lines([line], speeddict)[0]
 
         # Transaction Type
         ttype2odoo = {
@@ -87,17 +273,8 @@ class MooncardCsvImport(models.TransientModel):
         # Card
         if line.get('card_token'):
             if line['card_token'] not in speeddict['tokens']:
-                existing_card = npco.search([
-                    ('company_id', '=', self.company_id.id),
-                    ('journal_id', '!=', False),
-                    ], limit=1, order='id desc')
-                journal_id = existing_card and existing_card.journal_id.id or False
-                card = npco.sudo().create({
-                    'name': line['card_token'],
-                    'company_id': self.company_id.id,
-                    'journal_id': journal_id,
-                    })
-                speeddict['tokens'][line['card_token']] = card.id
+                speeddict['tokens'].update(
+                    self._get_or_create_cards([line['card_token']]))
             card_id = speeddict['tokens'][line['card_token']]
 
         # Accounts
@@ -120,88 +297,27 @@ class MooncardCsvImport(models.TransientModel):
 
         # Partner
         if transaction_type == 'expense':
-            vendor = line.get('supplier') and line['supplier'].strip()
-
-            if line.get('supplier_vat_number') and line['supplier_vat_number'].strip():
-                raw_vat = line['supplier_vat_number'].strip().replace(' ', '').upper()
-                if is_valid(raw_vat):
-                    vendor_vat = raw_vat
-                else:
-                    logger.warning("Supplier VAT number %s is invalid.", raw_vat)
-
-            # Partner matching
-            # 1. Try to match on VAT
-            if vendor_vat and vendor_vat in speeddict['partner_vat']:
-                partner_id = speeddict['partner_vat'][vendor_vat]
-                logger.debug('Partner ID %d matched on VAT %s', partner_id, vendor_vat)
-
-            if (
-                    not partner_id and
-                    vendor and
-                    len(vendor) >= MEANINGFUL_PARTNER_NAME_MIN_SIZE):
-                # 2. Try to match on labels : exact match
-                vendor_label = unidecode(vendor).upper()
-                if vendor_label in speeddict['partner_labels']:
-                    partner_id = speeddict['partner_labels'][vendor_label]
-                    logger.debug(
-                        'Partner ID %d matched on label %s', partner_id, vendor_label)
-
-                # 3. Try to match on partner name (configurable)
-                if (
-                        not partner_id and
-                        speeddict['partner_match_rule'] and
-                        speeddict['partner_match_rule'] != 'False'):
-                    for speed_entry in speeddict['partner_names'].items():
-                        partner_match = self.partner_match(
-                            vendor_label, speed_entry, speeddict['partner_match_rule'])
-                        if partner_match:
-                            partner_id = partner_match
-                            logger.debug(
-                                "Partner ID %d matched on name '%s' with "
-                                "partner_match_rule=%s",
-                                partner_id, vendor_label,
-                                speeddict['partner_match_rule'])
-                            break
+            # the partner only depends on the vendor and its VAT number
+            partner_memo = self._get_import_memo(speeddict, 'partner')
+            partner_key = (norm['vendor'], norm['vendor_vat'])
+            with self._timing(speeddict, 'partner_matching'):
+                if partner_key not in partner_memo:
+                    partner_memo[partner_key] = self._match_partner(
+                        norm['vendor'], norm['vendor_vat'], speeddict)
+                partner_id = partner_memo[partner_key]
             # Fallback on Mooncard misc supplier
             if not partner_id:
                 partner_id = speeddict['default_partner_id']
 
-        country_id = False
-        if line.get('country_code'):
-            if len(line['country_code']) == 2:
-                country_id = speeddict['countries'].get(line['country_code'])
-            elif len(line['country_code']) == 3:
-                logger.debug(
-                    'search country with code %s with pycountry',
-                    line['country_code'])
-                pcountry = pycountry.countries.get(alpha_3=line['country_code'])
-                if pcountry and pcountry.alpha_2:
-                    country_id = speeddict['countries'].get(pcountry.alpha_2)
-            elif len(line['country_code']) > 3:
-                # Workaround Mooncard bug, fixed by mooncard on 20/09/2022
-                country_name = unidecode(line['country_code'].strip()).lower()
-                if country_name in speeddict['country_names']:
-                    country_id = speeddict['country_names'][country_name]
-
-        # VAT rate
-        vat_rate = 0
+        country_id = norm['country_id']
         autoliquidation = 'none'
-        if not float_is_zero(line['vat_eur'], precision_digits=2):
-            rates_amount = [
-                ('20.0', abs(line['vat_20_id'])),
-                ('10.0', abs(line['vat_10_id'])),
-                ('5.5', abs(line['vat_55_id'])),
-                ('2.1', abs(line['vat_21_id'])),
-                ]
-            rates_amount_sorted = sorted(
-                rates_amount, key=lambda to_sort: to_sort[1])
-            vat_rate = rates_amount_sorted[-1][0]
-        else:
-            if country_id and country_id != speeddict['my_country_id']:
-                if country_id in speeddict['eu_country_ids']:
-                    autoliquidation = 'intracom'
-                else:
-                    autoliquidation = 'extracom'
+        if (
+                float_is_zero(line['vat_eur'], precision_digits=2) and
+                country_id and country_id != speeddict['my_country_id']):
+            if country_id in speeddict['eu_country_ids']:
+                autoliquidation = 'intracom'
+            else:
+                autoliquidation = 'extracom'
 
         vals = {
             'transaction_type': transaction_type,
@@ -210,12 +326,12 @@ class MooncardCsvImport(models.TransientModel):
             'expense_account_id': expense_account_id,
             'analytic_distribution': analytic_distribution,
             'vat_company_currency': line['vat_eur'],
-            'vat_rate': vat_rate,
+            'vat_rate': norm['vat_rate'],
             'image_url': line.get('attachment'),
             'receipt_number': line.get('receipt_code'),
             'partner_id': partner_id,
             'country_id': country_id,
-            'vendor_vat': vendor_vat,
+            'vendor_vat': norm['vendor_vat'],
             'autoliquidation': autoliquidation,
             }
 
@@ -223,23 +339,14 @@ class MooncardCsvImport(models.TransientModel):
             return vals
 
         # Continue with fields required for create
-        payment_date = False
         currency_id = speeddict['currencies'].get(line.get('original_currency'))
-        if (
-                transaction_type == 'expense' and
-                line.get('date_authorization')):
-            # Mooncard now always gives us datetime in UTC
-            # example : 2019-04-18 13:35:06 UTC
-            payment_date = datetime.strptime(
-                line['date_authorization'], '%Y-%m-%d %H:%M:%S %Z')
-
         vals.update({
             'company_id': self.company_id.id,
             'unique_import_id': line.get('id'),
             'date': line['date_transaction'] and line['date_transaction'][:10],
-            'payment_date': payment_date,
+            'payment_date': norm['payment_date'],
             'card_id': card_id,
-            'vendor': line.get('supplier') and line['supplier'].strip(),
+            'vendor': norm['vendor'],
             'total_company_currency': line['amount_eur'],
             'total_currency': line['amount_currency'],
             'currency_id': currency_id,
@@ -308,37 +415,224 @@ class MooncardCsvImport(models.TransientModel):
         return vals
 
     @api.model
-    def _prepare_mileage_speeddict(self, company):
+    def _prepare_mileage_speeddict(self, company, keys=None):
+        """keys is an optional dict returned by _collect_mileage_keys():
+        when it is given, only the partners and analytic accounts
+        of the file are read"""
         bdio = self.env['business.document.import']
+        npcto = self.env['newgen.payment.card.transaction']
         speeddict = {'partner': {}, 'analytic': {}, 'accounts': {}}
 
-        partner_res = self.env['res.partner'].search_read(
-            [('email', '!=', False)], ['email'])
-        for partner in partner_res:
-            email = partner['email'].strip().lower()
-            speeddict['partner'][email] = partner['id']
-
-        analytic_res = self.env['account.analytic.account'].search_read(
-            [('company_id', '=', company.id), ('code', '!=', False)], ['code'])
-        for analytic in analytic_res:
-            analytic_code = analytic['code'].strip().lower()
-            speeddict['analytic'][analytic_code] = analytic['id']
+        partner_domain = [('email', '!=', False)]
+        analytic_domain = [('company_id', '=', company.id), ('code', '!=', False)]
+        if keys is not None:
+            speeddict['partner'] = npcto._search_read_normalized_in(
+                'res.partner', 'email', keys['emails'], partner_domain)
+            speeddict['analytic'] = npcto._search_read_normalized_in(
+                'account.analytic.account', 'code', keys['analytic'],
+                analytic_domain)
+        else:
+            partner_res = self.env['res.partner'].search_read(
+                partner_domain, ['email'])
+            for partner in partner_res:
+                email = partner['email'].strip().lower()
+                speeddict['partner'][email] = partner['id']
+
+            analytic_res = self.env['account.analytic.account'].search_read(
+                analytic_domain, ['code'])
+            for analytic in analytic_res:
+                analytic_code = analytic['code'].strip().lower()
+                speeddict['analytic'][analytic_code] = analytic['id']
         speeddict['accounts'] = bdio._prepare_account_speed_dict()
         return speeddict
 
-    def mooncard_import_mileage(self, fileobj):
-        mmo = self.env['mooncard.mileage']
-        speeddict = self._prepare_mileage_speeddict(self.company_id)
+    @api.model
+    def _collect_mileage_keys(self, lines):
+        """First pass of the import: returns the emails and analytic codes
+        of the lines, to read only those in the speeddict"""
+        keys = {'emails': set(), 'analytic': set()}
+        for line in lines:
+            if line.get('Code utilisateur'):
+                keys['emails'].add(line['Code utilisateur'].strip().lower())
+            if line.get('Codes analytiques'):
+                keys['analytic'].add(line['Codes analytiques'].lower())
+        return keys
+
+    @api.model
+    def _collect_transaction_keys(self, lines):
+        """First pass of the import: returns the card tokens, analytic codes,
+        country codes, currencies and vendor labels of the lines, to read
+        only those in the speeddict"""
+        npcplo = self.env['newgen.payment.card.partner.label']
+        keys = {
+            'tokens': set(), 'analytic': set(), 'countries': set(),
+            'currencies': set(), 'partner_labels': set()}
+        for line in lines:
+            if line.get('card_token'):
+                keys['tokens'].add(line['card_token'])
+            if line.get('supplier') and line['supplier'].strip():
+                keys['partner_labels'].add(
+                    npcplo._normalize_label(line['supplier']))
+            if line.get('analytic_code_1'):
+                keys['analytic'].add(line['analytic_code_1'].lower())
+            if line.get('original_currency'):
+                keys['currencies'].add(line['original_currency'])
+            country_code = line.get('country_code')
+            if country_code and len(country_code) == 2:
+                keys['countries'].add(country_code)
+            elif country_code and len(country_code) == 3:
+                pcountry = pycountry.countries.get(alpha_3=country_code)
+                if pcountry and pcountry.alpha_2:
+                    keys['countries'].add(pcountry.alpha_2)
+        return keys
+
+    @api.model
+    def _collect_keys(self, lines, file_format):
+        if file_format == 'mileage':
+            return self._collect_mileage_keys(lines)
+        return self._collect_transaction_keys(lines)
+
+    @api.model
+    def _is_two_pass_import(self):
+        """The import is done in two passes by default. Set the system
+        parameter mooncard.import_two_pass to False to go back to the
+        single-pass import (speeddict of all the records)"""
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param(
+            'mooncard.import_two_pass', 'True'))
+
+    @api.model
+    def _get_existing_records(self, model, import_ids):
+        """Return a dict unique_import_id -> record, restricted to the
+        import IDs given in argument (instead of reading the full table)"""
+        existing = {}
+        import_ids = list(set(import_ids))
+        for sub_import_ids in split_every(IMPORT_ID_SEARCH_CHUNK, import_ids, list):
+            records = model.search([('unique_import_id', 'in', sub_import_ids)])
+            for record in records:
+                existing[record.unique_import_id] = record
+        return existing
+
+    @api.model
+    def _get_changed_vals(self, record, vals):
+        """Returns the part of vals that would change the values
+        stored on record"""
+        changed_vals = {}
+        for field_name, value in vals.items():
+            field = record._fields[field_name]
+            # convert_to_cache applies the rounding of floats/monetaries,
+            # the JSON serialization and converts dates and many2one
+            new_value = field.convert_to_cache(value, record)
+            old_value = field.convert_to_cache(record[field_name], record)
+            if new_value != old_value:
+                changed_vals[field_name] = value
+        return changed_vals
+
+    @api.model
+    def _add_to_write_groups(self, write_groups, record, vals):
+        """Add record to the group of records to write with the same vals.
+        Nothing is added when vals doesn't change the record."""
+        changed_vals = self._get_changed_vals(record, vals)
+        if not changed_vals:
+            logger.debug('No change on %s ID %d', record._name, record.id)
+            return
+        key = (record._name, json.dumps(changed_vals, sort_keys=True, default=str))
+        if key in write_groups:
+            write_groups[key][1].append(record.id)
+        else:
+            write_groups[key] = (changed_vals, [record.id])
+        logger.debug(
+            'Fields to update on %s ID %d: %s',
+            record._name, record.id, changed_vals)
+
+    @api.model
+    def _write_groups(self, write_groups):
+        """Write the groups built by _add_to_write_groups(), with one
+        write per distinct set of values"""
+        if not write_groups:
+            return
+        for (model_name, _key), (changed_vals, record_ids) in write_groups.items():
+            self.env[model_name].browse(record_ids).write(changed_vals)
+        write_groups.clear()
+
+    @api.model
+    def _get_line_hash(self, line):
+        """Hash of the line as read in the CSV file, before any conversion"""
+        return hashlib.sha1(
+            json.dumps(line, sort_keys=True).encode('utf8')).hexdigest()
+
+    @api.model
+    def _write_import_hashes(self, model, import_hashes):
+        """Store the hashes of the lines (dict with key = record ID and
+        value = hash). Each record has its own hash, so the ORM would
+        write them one by one: they are written with one query per chunk"""
+        if not import_hashes:
+            return
+        model.flush_model(['import_hash'])
+        for hashes_chunk in split_every(
+                IMPORT_ID_SEARCH_CHUNK, import_hashes.items(), list):
+            self.env.cr.execute(
+                'UPDATE "%s" AS rec SET import_hash=val.import_hash '
+                'FROM (VALUES %s) AS val (id, import_hash) '
+                'WHERE rec.id=val.id' % (
+                    model._table, ', '.join(['%s'] * len(hashes_chunk))),
+                hashes_chunk)
+        model.invalidate_model(['import_hash'])
+
+    @api.model
+    def _get_create_chunk_size(self):
+        chunk_size = self.env['ir.config_parameter'].sudo().get_param(
+            'mooncard.import_create_chunk_size', default=DEFAULT_CREATE_CHUNK_SIZE)
+        try:
+            chunk_size = int(chunk_size)
+        except ValueError:
+            raise UserError(_(
+                "The value of the system parameter "
+                "'mooncard.import_create_chunk_size' (%s) is not an integer.")
+                % chunk_size)
+        return max(chunk_size, 1)
+
+    def _decode_mooncard_file(self):
+        """Decode the base64 of the uploaded file by blocks into a
+        temporary file, to avoid having a second full copy of the file
+        in memory. Returns the temporary file, positionned at the start"""
+        self.ensure_one()
+        data = self.mooncard_file
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        fileobj = TemporaryFile('wb+')
+        pending = b''
+        view = memoryview(data)
+        for start in range(0, len(data), B64_DECODE_BLOCK_SIZE):
+            block = pending + bytes(view[start:start + B64_DECODE_BLOCK_SIZE])
+            block = block.replace(b'\n', b'').replace(b'\r', b'')
+            # base64 can only be decoded by groups of 4 characters
+            cut = len(block) - len(block) % 4
+            fileobj.write(base64.b64decode(block[:cut]))
+            pending = block[cut:]
+        if pending:
+            fileobj.write(base64.b64decode(pending))
+        fileobj.seek(0)
+        return fileobj
+
+    @api.model
+    def _sniff_file_format(self, fileobj):
+        """Read the first line of the file only. Returns 'mileage' or
+        'transaction'"""
+        fileobj.seek(0)
+        first_line = fileobj.readline()
+        fileobj.seek(0)
+        if first_line.startswith(MILEAGE_HEADER.encode('latin1')):
+            return 'mileage'
+        return 'transaction'
+
+    @api.model
+    def _iter_csv_lines(self, fileobj, id_field, delimiter=',', encoding='utf8'):
+        """Generator that yields the lines of the CSV file one by one"""
         fileobj.seek(0)
         reader = unicodecsv.DictReader(
-            fileobj, delimiter=';',
-            quoting=unicodecsv.QUOTE_MINIMAL, encoding='latin1')
+            fileobj, delimiter=delimiter,
+            quoting=unicodecsv.QUOTE_MINIMAL, encoding=encoding)
         i = 0
-        exiting_mileage = {}
-        existings = mmo.search([])
-        for line in existings:
-            exiting_mileage[line.unique_import_id] = line
-        mm_ids = []
         for line in reader:
             i += 1
             # replace '' by False, so as to make the domains such as
@@ -350,9 +644,25 @@ class MooncardCsvImport(models.TransientModel):
                 else:
                     line[key] = False
             logger.debug("line=%s", line)
-            if not line.get('Identifiant unique'):
+            if not line.get(id_field):
                 raise UserError(_(
                     "Missing ID in CSV file line %d.") % i)
+            yield line
+
+    def _import_mileage_lines(self, lines, speeddict):
+        """Create or update the mileages of a chunk of lines.
+        Returns the list of IDs of the mileages created or updated"""
+        mmo = self.env['mooncard.mileage']
+        with self._timing(speeddict, 'lookup'):
+            exiting_mileage = self._get_existing_records(
+                mmo, [line['Identifiant unique'] for line in lines])
+        mm_ids = []
+        to_create = []
+        write_groups = {}
+        # key = mileage ID, value = hash of the line
+        import_hashes = {}
+        for line in lines:
+            line_hash = self._get_line_hash(line)
             existing_import_id = False
             if line['Identifiant unique'] in exiting_mileage:
                 existing_import_id = line['Identifiant unique']
@@ -362,72 +672,53 @@ class MooncardCsvImport(models.TransientModel):
                     'Existing line with unique ID %s (odoo ID %s, state %s)',
                     existing_import_id, mileage.id, mileage.state)
                 if mileage.state == 'draft':
-                    # update existing lines
-                    wvals = self._prepare_mileage(
-                        line, speeddict, action='update')
-                    mileage.write(wvals)
                     mm_ids.append(mileage.id)
+                    if mileage.import_hash == line_hash:
+                        logger.debug(
+                            'Line with unique ID %s unchanged since the '
+                            'last import', existing_import_id)
+                        continue
+                    # update existing lines
+                    with self._timing(speeddict, 'prepare'):
+                        wvals = self._prepare_mileage(
+                            line, speeddict, action='update')
+                    self._add_to_write_groups(write_groups, mileage, wvals)
+                    import_hashes[mileage.id] = line_hash
                 continue
-            vals = self._prepare_mileage(line, speeddict)
-            mileage = mmo.create(vals)
-            mm_ids.append(mileage.id)
+            with self._timing(speeddict, 'prepare'):
+                vals = self._prepare_mileage(line, speeddict)
+            vals['import_hash'] = line_hash
+            to_create.append(vals)
+        with self._timing(speeddict, 'write'):
+            self._write_groups(write_groups)
+            self._write_import_hashes(mmo, import_hashes)
+        if to_create:
+            with self._timing(speeddict, 'create'):
+                mm_ids += mmo.create(to_create).ids
+        return mm_ids
+
+    def mooncard_import_mileage(self, fileobj):
+        mm_ids, stats = self._import_file(fileobj, 'mileage')
         fileobj.close()
-        if not mm_ids:
-            raise UserError(_("No Mooncard mileage created nor updated."))
-        action = self.env['ir.actions.actions']._for_xml_id(
-            'mooncard_payment_card.mooncard_mileage_action')
-        action.update({
-            'domain': "[('id', 'in', %s)]" % mm_ids,
-            'views': False,
-            })
-        return action
+        return self._get_result_action('mileage', mm_ids)
 
-    def mooncard_import(self):
-        self.ensure_one()
+    def _import_transaction_lines(self, lines, speeddict):
+        """Create or update the transactions of a chunk of lines.
+        Returns the list of IDs of the transactions created or updated"""
         npcto = self.env['newgen.payment.card.transaction']
-        ico = self.env['ir.config_parameter']
-        speeddict = npcto._prepare_import_speeddict(self.company_id)
-        # Temporary hack until mooncard restores the country_code column
-        speeddict['country_names'] = {}
-        countries = self.env['res.country'].with_context(lang='fr_FR').search_read(
-            [('name', '!=', False)], ['name'])
-        for country in countries:
-            country_name = unidecode(country['name'].strip()).lower()
-            speeddict['country_names'][country_name] = country['id']
-        speeddict['partner_match_rule'] = ico.sudo().get_param(
-            'mooncard.partner_match_rule', default='contain')
-        logger.info('Importing Mooncard transactions.csv')
-        fileobj = TemporaryFile('wb+')
-        fileobj.write(base64.b64decode(self.mooncard_file))
-        fileobj.seek(0)
-        file_content = fileobj.read()
-        if file_content.startswith(
-                'Identifiant unique;Date de dépense;Heure;Date de débit;Montant devise;Devise;Montant;Payment method;Pays;Adresse du marchand;Marchand;Fournisseur;Collaborateur'.encode('latin1')):  # noqa: E501
-            return self.mooncard_import_mileage(fileobj)
-        fileobj.seek(0)
-        reader = unicodecsv.DictReader(
-            fileobj, delimiter=',',
-            quoting=unicodecsv.QUOTE_MINIMAL, encoding='utf8')
-        i = 0
-        exiting_transactions = {}
-        existings = npcto.search([])
-        for line in existings:
-            exiting_transactions[line.unique_import_id] = line
+        import_ids = set()
+        for line in lines:
+            import_ids.add(line['id'])
+            if line.get('transaction_id'):
+                import_ids.add(line['transaction_id'])
+        with self._timing(speeddict, 'lookup'):
+            exiting_transactions = self._get_existing_records(npcto, import_ids)
         mt_ids = []
-        for line in reader:
-            i += 1
-            # replace '' by False, so as to make the domains such as
-            # ('image_url', '!=', False) work
-            # and strip regular strings
-            for key, value in line.items():
-                if value:
-                    line[key] = value.strip()
-                else:
-                    line[key] = False
-            logger.debug("line=%s", line)
-            if not line.get('id'):
-                raise UserError(_(
-                    "Missing ID in CSV file line %d.") % i)
+        # list of (line, hash of the line, existing transaction or None)
+        to_prepare = []
+        for line in lines:
+            # the hash is computed before the line is converted
+            line_hash = self._get_line_hash(line)
             # line['transaction_id'] used for the transition
             # from transactions.csv to Mooncard bank statements
             existing_import_id = False
@@ -445,24 +736,207 @@ class MooncardCsvImport(models.TransientModel):
                     'Existing line with unique ID %s (odoo ID %s, state %s)',
                     existing_import_id, transaction.id, transaction.state)
                 if transaction.state == 'draft':
+                    mt_ids.append(transaction.id)
+                    if transaction.import_hash == line_hash:
+                        logger.debug(
+                            'Line with unique ID %s unchanged since the '
+                            'last import', existing_import_id)
+                        continue
                     # update existing lines
+                    to_prepare.append((line, line_hash, transaction))
+                continue
+            to_prepare.append((line, line_hash, None))
+        with self._timing(speeddict, 'normalize'):
+            norms = self._normalize_transaction_lines(
+                [line for (line, line_hash, transaction) in to_prepare],
+                speeddict)
+        to_create = []
+        write_groups = {}
+        # key = transaction ID, value = hash of the line
+        import_hashes = {}
+        for (line, line_hash, transaction), norm in zip(to_prepare, norms):
+            if transaction is not None:
+                with self._timing(speeddict, 'prepare'):
                     wvals = self._prepare_transaction(
-                        line, speeddict, action='update')
-                    transaction.write(wvals)
-                    mt_ids.append(transaction.id)
+                        line, speeddict, action='update', norm=norm)
+                self._add_to_write_groups(write_groups, transaction, wvals)
+                import_hashes[transaction.id] = line_hash
                 continue
-            vals = self._prepare_transaction(line, speeddict)
-            transaction = npcto.create(vals)
-            mt_ids.append(transaction.id)
+            with self._timing(speeddict, 'prepare'):
+                vals = self._prepare_transaction(line, speeddict, norm=norm)
+            vals['import_hash'] = line_hash
+            to_create.append(vals)
+        with self._timing(speeddict, 'write'):
+            self._write_groups(write_groups)
+            self._write_import_hashes(npcto, import_hashes)
+        if to_create:
+            with self._timing(speeddict, 'create'):
+                mt_ids += npcto.create(to_create).ids
+        return mt_ids
+
+    def _prepare_transaction_import_speeddict(self, keys=None):
+        self.ensure_one()
+        npcto = self.env['newgen.payment.card.transaction']
+        ico = self.env['ir.config_parameter']
+        speeddict = npcto._prepare_import_speeddict(self.company_id, keys=keys)
+        # Temporary hack until mooncard restores the country_code column
+        speeddict['country_names'] = {}
+        countries = self.env['res.country'].with_context(lang='fr_FR').search_read(
+            [('name', '!=', False)], ['name'])
+        for country in countries:
+            country_name = unidecode(country['name'].strip()).lower()
+            speeddict['country_names'][country_name] = country['id']
+        speeddict['partner_match_rule'] = ico.sudo().get_param(
+            'mooncard.partner_match_rule', default='contain')
+        return speeddict
+
+    @api.model
+    def _iter_file_lines(self, fileobj, file_format):
+        if file_format == 'mileage':
+            return self._iter_csv_lines(
+                fileobj, 'Identifiant unique', delimiter=';', encoding='latin1')
+        return self._iter_csv_lines(fileobj, 'id')
+
+    @contextmanager
+    def _timing(self, speeddict, phase):
+        """Add the time spent in the block to speeddict['timings'][phase]
+        (if the speeddict has timings)"""
+        timings = speeddict.get('timings')
+        if timings is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[phase] += time.perf_counter() - start
+
+    def _prepare_speeddict(self, file_format, keys=None):
+        self.ensure_one()
+        if file_format == 'mileage':
+            return self._prepare_mileage_speeddict(self.company_id, keys=keys)
+        return self._prepare_transaction_import_speeddict(keys=keys)
+
+    def _import_file(self, fileobj, file_format):
+        """Import all the lines of the file, by chunks.
+        Returns the IDs of the records created or updated and a dict with
+        the number of lines and the time spent in each phase
+        (partner_matching is included in prepare)"""
+        self.ensure_one()
+        start = time.perf_counter()
+        keys = None
+        if self._is_two_pass_import():
+            keys = self._collect_keys(
+                self._iter_file_lines(fileobj, file_format), file_format)
+        keys_duration = time.perf_counter() - start
+        speeddict = self._prepare_speeddict(file_format, keys=keys)
+        if file_format == 'mileage':
+            import_method = self._import_mileage_lines
+        else:
+            import_method = self._import_transaction_lines
+        speeddict['timings'] = timings = defaultdict(float)
+        timings['keys'] = keys_duration
+        timings['speeddict'] = time.perf_counter() - start - keys_duration
+        chunks = split_every(
+            self._get_create_chunk_size(),
+            self._iter_file_lines(fileobj, file_format), list)
+        ids = []
+        line_count = 0
+        while True:
+            with self._timing(speeddict, 'parsing'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            line_count += len(chunk)
+            ids += import_method(chunk, speeddict)
+        duration = time.perf_counter() - start
+        stats = {
+            'lines': line_count,
+            'duration': duration,
+            'lines_per_second': duration and line_count / duration or 0,
+            'timings': dict(timings),
+            }
+        logger.info(
+            'Mooncard import of %d %s lines in %.2fs (%.0f lines/s): %s',
+            line_count, file_format, duration, stats['lines_per_second'],
+            ', '.join(
+                '%s %.2fs' % (phase, timing)
+                for (phase, timing) in sorted(timings.items())))
+        return ids, stats
+
+    @api.model
+    def _get_result_action(self, file_format, ids):
+        if file_format == 'mileage':
+            if not ids:
+                raise UserError(_("No Mooncard mileage created nor updated."))
+            action = self.env['ir.actions.actions']._for_xml_id(
+                'mooncard_payment_card.mooncard_mileage_action')
+        else:
+            if not ids:
+                raise UserError(_(
+                    "No payment card transaction created nor updated."))
+            action = self.env.ref(
+                'base_newgen_payment_card.newgen_payment_card_transaction_action'
+                ).read()[0]
+        action.update({
+            'domain': "[('id', 'in', %s)]" % ids,
+            'views': False,
+            })
+        return action
+
+    def _create_import_job(self):
+        """Split the file in chunks that are imported by the cron
+        'Mooncard Import Jobs' and returns the action of the job"""
+        self.ensure_one()
+        fileobj = self._decode_mooncard_file()
+        file_format = self._sniff_file_format(fileobj)
+        job = self.env['mooncard.import.job'].create({
+            'name': self.filename or _('Mooncard Import'),
+            'company_id': self.company_id.id,
+            'filename': self.filename,
+            'file_format': file_format,
+            })
+        lines = self._iter_file_lines(fileobj, file_format)
+        chunk_size = self._get_create_chunk_size()
+        tokens = set()
+        for sequence, chunk in enumerate(split_every(chunk_size, lines, list)):
+            if file_format == 'transaction':
+                tokens.update(
+                    line['card_token'] for line in chunk if line.get('card_token'))
+            self.env['mooncard.import.job.chunk'].create({
+                'job_id': job.id,
+                'sequence': sequence,
+                'line_count': len(chunk),
+                'lines': json.dumps(chunk),
+                })
         fileobj.close()
-        if not mt_ids:
-            raise UserError(_(
-                "No payment card transaction created nor updated."))
-        action = self.env.ref(
-            'base_newgen_payment_card.newgen_payment_card_transaction_action'
-            ).read()[0]
+        # The cards are created once for the whole file: a chunk retried
+        # by a user while the scheduled action imports another one
+        # would otherwise create the same new card twice
+        self._get_or_create_cards(tokens)
+        if not job.chunk_ids:
+            raise UserError(_("The file doesn't contain any line."))
+        logger.info(
+            'Mooncard import job %s created with %d chunks',
+            job.name, len(job.chunk_ids))
+        job._trigger_processing()
+        action = self.env['ir.actions.actions']._for_xml_id(
+            'mooncard_payment_card.mooncard_import_job_action')
         action.update({
-            'domain': "[('id', 'in', %s)]" % mt_ids,
+            'view_mode': 'form,tree',
             'views': False,
+            'res_id': job.id,
             })
         return action
+
+    def mooncard_import(self):
+        self.ensure_one()
+        if self.background:
+            return self._create_import_job()
+        fileobj = self._decode_mooncard_file()
+        if self._sniff_file_format(fileobj) == 'mileage':
+            return self.mooncard_import_mileage(fileobj)
+        logger.info('Importing Mooncard transactions.csv')
+        mt_ids, stats = self._import_file(fileobj, 'transaction')
+        fileobj.close()
+        return self._get_result_action('transaction', mt_ids)